@@ -0,0 +1,18 @@
+import os
+
+CACHES = {
+    'default': {
+        # Бэкенд кэша ответов API задаётся окружением: по умолчанию
+        # локальная память процесса, для тестов подойдёт и файловый
+        # django.core.cache.backends.filebased.FileBasedCache
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'movies-api'),
+        'TIMEOUT': int(os.environ.get('DJANGO_CACHE_TIMEOUT', 300)),
+    }
+}
+
+# Поиск кэшируется недолго: индекс обновляется ETL без сброса кэша
+SEARCH_CACHE_TIMEOUT = int(os.environ.get('DJANGO_SEARCH_CACHE_TIMEOUT', 10))
+SEARCH_TIMEOUT = int(os.environ.get('DJANGO_SEARCH_TIMEOUT', 5))
@@ -15,6 +15,7 @@ SECRET_KEY = os.environ.get('SECRET_KEY')
 
 include(
     'components/database.py',
+    'components/cache.py',
 )
 
 
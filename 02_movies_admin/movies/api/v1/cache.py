@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+#
+# Кэш готовых ответов API фильмов.
+# Ответы по фильму лежат под ключом его id и сбрасываются точечно,
+# страницы списка - под текущей версией, которая растёт при любом изменении
+#
+
+PAGES_VERSION_KEY = 'movies:pages:version'
+STATS_REPORT_EVERY = 100
+
+
+def film_key(id):
+    return f'movies:film:{id}'
+
+
+def _params_digest(params):
+    # the same params in any order give the same digest
+    query = '&'.join(f'{key}={value}'
+                     for key, values in sorted(params.lists())
+                     for value in values)
+    return hashlib.md5(query.encode()).hexdigest()
+
+
+def page_key(params):
+    'key of a list page for the given query params, in any order'
+    digest = _params_digest(params)
+    # the version only grows, even if the key itself got culled
+    cache.add(PAGES_VERSION_KEY, int(time.time() * 1000), None)
+    return f'movies:pages:{cache.get(PAGES_VERSION_KEY)}:{digest}'
+
+
+def search_key(params):
+    'key of search results, these just expire as the index is updated'
+    return f'movies:search:{_params_digest(params)}'
+
+
+def get_response(key, variant='', etag=None):
+    'cached body of the variant and the etag it was rendered under'
+    # variants (e.g. sparse fieldsets) share the key, to be evicted together;
+    # given an etag, a body rendered under another one is not served, as
+    # eviction misses changes made by other processes, e.g. dbimport
+    cached_etag, content = cache.get(key, {}).get(variant, (None, None))
+    if etag is not None and cached_etag != etag:
+        content = None
+    _count('hit' if content is not None else 'miss')
+    return cached_etag, content
+
+
+def set_response(key, content, variant='', etag=None):
+    variants = cache.get(key, {})
+    variants[variant] = (etag, content)
+    cache.set(key, variants)
+
+
+def evict_films(ids):
+    'drop responses of the films and all list pages after commit'
+    keys = [film_key(id) for id in ids]
+
+    def evict():
+        cache.delete_many(keys)
+        try:
+            cache.incr(PAGES_VERSION_KEY)
+        except ValueError:
+            # not there yet - nothing cached under it either
+            pass
+
+    if keys:
+        transaction.on_commit(evict)
+
+
+def _count(outcome):
+    key = f'movies:stats:{outcome}'
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        return
+
+    stats = cache_stats()
+    if (stats['hits'] + stats['misses']) % STATS_REPORT_EVERY == 0:
+        logger.info(f'### Cache: {stats["hits"]} hits, '
+                    f'{stats["misses"]} misses, '
+                    f'hit ratio {stats["hit_ratio"]:.2%}')
+
+
+def cache_stats():
+    'hit/miss counters of the movies api cache'
+    hits = cache.get('movies:stats:hit', 0)
+    misses = cache.get('movies:stats:miss', 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / total if total else 0.0,
+    }
@@ -0,0 +1,73 @@
+from django import forms
+
+from movies.models import Filmwork, GenreFilmwork, PersonFilmwork
+
+
+class MoviesFilterForm(forms.Form):
+    '''
+    Filters and sort orders of the movie list, taken from query params.
+    Every filter and sort key is backed by an index on the models.
+    '''
+    # sort keys and orderings, ties are broken by id in the same direction
+    sort_map = {
+        'title': ('title', 'id'),
+        '-title': ('-title', '-id'),
+        'rating': ('rating', 'id'),
+        '-rating': ('-rating', '-id'),
+        'creation_date': ('creation_date', 'id'),
+        '-creation_date': ('-creation_date', '-id'),
+        'updated_at': ('updated_at', 'id'),
+        '-updated_at': ('-updated_at', '-id'),
+    }
+
+    type = forms.ChoiceField(
+        choices=Filmwork.FilmworkType.choices, required=False)
+    genre = forms.UUIDField(required=False)
+    person = forms.UUIDField(required=False)
+    rating_min = forms.FloatField(required=False)
+    rating_max = forms.FloatField(required=False)
+    creation_date_from = forms.DateField(required=False)
+    creation_date_to = forms.DateField(required=False)
+    sort = forms.ChoiceField(
+        choices=[(key, key) for key in sort_map], required=False)
+
+    def filter_queryset(self, queryset):
+        data = self.cleaned_data
+        lookups = {
+            'type': 'type',
+            'rating_min': 'rating__gte',
+            'rating_max': 'rating__lte',
+            'creation_date_from': 'creation_date__gte',
+            'creation_date_to': 'creation_date__lte',
+        }
+        queryset = queryset.filter(**{
+            lookup: data[name] for name, lookup in lookups.items()
+            if data[name] not in (None, '')
+        })
+
+        # semi-joins keep one row per film, whatever the number of roles
+        if data['genre']:
+            queryset = queryset.filter(id__in=GenreFilmwork.objects.filter(
+                genre_id=data['genre']).values('film_work_id'))
+        if data['person']:
+            queryset = queryset.filter(id__in=PersonFilmwork.objects.filter(
+                person_id=data['person']).values('film_work_id'))
+        return queryset
+
+    def get_ordering(self, default):
+        sort = self.cleaned_data['sort']
+        return MoviesFilterForm.sort_map[sort] if sort else default
+
+
+class SearchForm(forms.Form):
+    '''
+    Full-text query over titles and descriptions with the search filters,
+    taken from query params of the search endpoint.
+    '''
+    query = forms.CharField(required=False, max_length=255)
+    genre = forms.CharField(required=False, max_length=255)
+    rating_min = forms.FloatField(required=False)
+    rating_max = forms.FloatField(required=False)
+    page_size = forms.IntegerField(required=False, min_value=1,
+                                   max_value=100)
+    cursor = forms.CharField(required=False)
@@ -0,0 +1,156 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+
+def estimate_count(model):
+    'planner row estimate for the model table, kept fresh by autovacuum'
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [table])
+        row = cursor.fetchone()
+    return max(row[0], 0) if row else 0
+
+
+class ProbedPage(Page):
+    'page which knows from one extra fetched row whether another follows'
+    def __init__(self, object_list, number, paginator, more):
+        super().__init__(object_list, number, paginator)
+        self.more = more
+
+    def has_next(self):
+        return self.more
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Paginator which never counts the annotated page queryset.
+    The total is taken from a lightweight count queryset instead:
+    for the unfiltered catalog postgres statistics are used, once the table
+    is too large for an exact COUNT(*) to be cheap.
+    An estimated total is only shown, pages are not bound by it: each one
+    fetches a row more to tell whether there is a next one.
+    '''
+    exact_count_threshold = 100000
+
+    def __init__(self, object_list, per_page, count_queryset=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_queryset = count_queryset
+        self.estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.count_queryset
+        if queryset is None:
+            return super().count
+
+        # statistics only describe the whole table, not a filtered subset
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model)
+            if estimate >= self.exact_count_threshold:
+                self.estimated = True
+                return estimate
+        return queryset.count()
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # past the estimated last page is still fine, page() tells
+            if not self.estimated or int(number) < 1:
+                raise
+            return int(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.estimated:
+            return super().page(number)
+
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        more = len(rows) > self.per_page
+        # the estimate sizes pages ahead only, the probe knows where the
+        # list ends
+        self.num_pages = max(self.num_pages, number + 1) if more else number
+        return ProbedPage(rows[:self.per_page], number, self, more)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    '''
+    Keyset paginator: every page is an index range scan starting right after
+    the last key of the previous page, so deep pages cost the same as the
+    first one. Ordering fields may be descending ('-rating') and must end
+    with a unique one.
+    '''
+    def __init__(self, object_list, per_page, ordering=('updated_at', 'id')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = tuple(name.lstrip('-') for name in self.ordering)
+
+    def encode_cursor(self, key):
+        # str() keeps full microseconds, unlike DjangoJSONEncoder;
+        # ordering is kept to reject cursors of another sort order
+        payload = json.dumps([self.ordering, list(key)], default=str)
+        return urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        opts = self.object_list.model._meta
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            ordering, values = json.loads(urlsafe_b64decode(padded.encode()))
+            if tuple(ordering) != self.ordering or \
+                    len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            return [opts.get_field(name).to_python(value)
+                    for name, value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError) as ex:
+            raise InvalidCursor(cursor) from ex
+
+    def _after(self, key):
+        # (a, b) > (x, y) spelled out, led by a range on the first column
+        lookups = ['__lt' if name.startswith('-') else '__gt'
+                   for name in self.ordering]
+        after = Q()
+        for i, name in enumerate(self.fields):
+            equal = dict(zip(self.fields[:i], key[:i]))
+            after |= Q(**equal, **{name + lookups[i]: key[i]})
+        first = '__lte' if self.ordering[0].startswith('-') else '__gte'
+        return Q(**{self.fields[0] + first: key[0]}) & after
+
+    def page(self, cursor=None):
+        queryset = self.object_list.order_by(*self.ordering)
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+
+        # one extra row tells whether there is a next page at all
+        keys = list(queryset.values_list(
+            'pk', *self.fields)[:self.per_page + 1])
+        next_cursor = None
+        if len(keys) > self.per_page:
+            keys = keys[:self.per_page]
+            next_cursor = self.encode_cursor(keys[-1][1:])
+        return CursorPage([key[0] for key in keys], next_cursor)
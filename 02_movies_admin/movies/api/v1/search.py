@@ -0,0 +1,142 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from movies.api.v1.pagination import InvalidCursor
+
+try:
+    from elasticsearch import AsyncElasticsearch
+    from elasticsearch import RequestError, TransportError
+except ImportError:
+    AsyncElasticsearch = None
+
+#
+# Полнотекстовый поиск фильмов по индексу Elasticsearch,
+# который наполняет dbexport. Листание вперёд через search_after
+#
+
+SEARCH_INDEX = 'movies'
+
+# Under WSGI django runs every async view in an event loop of its own,
+# while an async client and its keep-alive connections are bound to the
+# loop they are first used in. So the client of a process runs in a loop
+# thread of its own, views await its requests from theirs.
+_client = None
+_loop = None
+_thread = None
+_lock = threading.Lock()
+
+
+class SearchUnavailable(Exception):
+    'elastic is down, failing or the index is not built yet'
+
+
+class InvalidSearch(Exception):
+    'elastic rejected the request, e.g. search_after values of wrong types'
+
+
+def encode_cursor(sort, values):
+    # the cursor is bound to the sort it was made for
+    data = json.dumps([sort, values]).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def decode_cursor(sort, cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, values = json.loads(data)
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if cursor_sort != sort or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def build_search(data, page_size):
+    'search request body for cleaned search form data'
+    filters = []
+    if data['genre']:
+        filters.append({'term': {'genre': data['genre']}})
+    rating = {bound: data[name] for name, bound in
+              (('rating_min', 'gte'), ('rating_max', 'lte'))
+              if data[name] is not None}
+    if rating:
+        filters.append({'range': {'imdb_rating': rating}})
+
+    if data['query']:
+        must = {'multi_match': {
+            'query': data['query'],
+            'fields': ['title^3', 'description'],
+            'analyzer': 'ru_en',
+        }}
+        sort = [{'_score': 'desc'}, {'id': 'asc'}]
+    else:
+        must = {'match_all': {}}
+        sort = [{'imdb_rating': 'desc'}, {'id': 'asc'}]
+
+    body = {
+        'size': page_size,
+        'query': {'bool': {'must': must, 'filter': filters}},
+        'sort': sort,
+    }
+    if data['cursor']:
+        body['search_after'] = decode_cursor(sort, data['cursor'])
+    return body
+
+
+def get_client():
+    'async client of the process and the event loop it runs in'
+    global _client, _loop, _thread
+    if AsyncElasticsearch is None:
+        raise ImproperlyConfigured('Search requires elasticsearch[async]')
+
+    with _lock:
+        if _client is None:
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(
+                target=_loop.run_forever, name='search', daemon=True)
+            _thread.start()
+            _client = AsyncElasticsearch(
+                [f'{os.environ["ELASTIC_HOST"]}:{os.environ["ELASTIC_PORT"]}'],
+                timeout=settings.SEARCH_TIMEOUT)
+        return _client, _loop
+
+
+def close_client():
+    'close the client and stop its loop, the next search makes a new one'
+    global _client, _loop, _thread
+    with _lock:
+        if _client is None:
+            return
+        asyncio.run_coroutine_threadsafe(_client.close(), _loop).result()
+        _loop.call_soon_threadsafe(_loop.stop)
+        _thread.join()
+        _loop.close()
+        _client = _loop = _thread = None
+
+
+async def search(body):
+    'run a search request, on the shared client'
+    client, loop = get_client()
+    try:
+        result = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+            client.search(index=SEARCH_INDEX, body=body), loop))
+    except RequestError as e:
+        raise InvalidSearch(e)
+    except TransportError as e:
+        raise SearchUnavailable(e)
+
+    hits = result['hits']['hits']
+    next_cursor = None
+    if len(hits) == body['size']:
+        next_cursor = encode_cursor(body['sort'], hits[-1]['sort'])
+    return {
+        'count': result['hits']['total']['value'],
+        'next_cursor': next_cursor,
+        'results': [hit['_source'] for hit in hits],
+    }
@@ -0,0 +1,84 @@
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+#
+# Сериализация ответов API в байты.
+# Бэкенд выбирается переменной API_JSON_BACKEND (orjson|ujson|json),
+# по умолчанию самый быстрый из установленных
+#
+
+
+class RawJSON(bytes):
+    'ready json fragment, e.g. rendered by postgres, passed through as is'
+
+
+def _dumps_orjson(data):
+    return orjson.dumps(data)
+
+
+def _dumps_ujson(data):
+    return ujson.dumps(data, ensure_ascii=False, default=str).encode()
+
+
+def _dumps_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+                      separators=(',', ':')).encode()
+
+
+backends_map = {
+    'orjson': _dumps_orjson if orjson else None,
+    'ujson': _dumps_ujson if ujson else None,
+    'json': _dumps_json,
+}
+
+
+def get_backend(name=None):
+    name = name or os.environ.get('API_JSON_BACKEND')
+    if name:
+        if not backends_map.get(name):
+            raise ImportError(f'JSON backend {name} is not available')
+        return backends_map[name]
+    return next(dumps for dumps in backends_map.values() if dumps)
+
+
+def _spliced(data, depth=2):
+    'whether a container holds raw fragments, looking a couple levels deep'
+    if isinstance(data, RawJSON):
+        return True
+    if depth == 0 or not isinstance(data, (dict, list)):
+        return False
+    values = data.values() if isinstance(data, dict) else data
+    return any(_spliced(value, depth - 1) for value in values)
+
+
+def dumps(data, backend=None):
+    '''
+    Serialize data to json bytes. RawJSON fragments in top level dicts
+    and lists are spliced into the output without re-encoding, anything
+    else goes to the json backend in one call.
+    '''
+    backend = backend or _backend
+    if not _spliced(data):
+        return backend(data)
+    if isinstance(data, RawJSON):
+        return data
+    if isinstance(data, dict):
+        return b'{' + b','.join(
+            backend(str(key)) + b':' + dumps(value, backend)
+            for key, value in data.items()) + b'}'
+    return b'[' + b','.join(dumps(value, backend) for value in data) + b']'
+
+
+_backend = get_backend()
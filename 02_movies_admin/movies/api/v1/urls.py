@@ -5,5 +5,7 @@ from movies.api.v1 import views
 
 urlpatterns = [
     path('movies/', views.MoviesListApi.as_view()),
+    path('movies/export/', views.MoviesExportApi.as_view()),
+    path('search/', views.movies_search),
     path('movies/<uuid:pk>/', views.MoviesDetailApi.as_view())
 ] 
\ No newline at end of file
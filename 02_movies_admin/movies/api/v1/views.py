@@ -1,58 +1,301 @@
+import hashlib
+from itertools import islice
 
-from django.contrib.postgres.aggregates import ArrayAgg
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import BadRequest
+from django.db.models import Q
+from django.http import Http404, HttpResponse
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.utils.translation import gettext as _
+from django.views.generic import View
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
-from django.db.models import Q
 
+from movies.documents import DOCUMENT_FIELDS, get_documents, get_stamps
 from movies.models import Filmwork
+from movies.api.v1.pagination import CursorPaginator, EstimatedCountPaginator
+from movies.api.v1.pagination import InvalidCursor
+from movies.api.v1.cache import film_key, page_key, search_key
+from movies.api.v1.filters import MoviesFilterForm, SearchForm
+from movies.api.v1.search import InvalidSearch, SearchUnavailable
+from movies.api.v1.search import build_search, search
+from movies.api.v1.cache import get_response, set_response
+from movies.api.v1.serializers import RawJSON, dumps
 
 class MoviesApiMixin:
+    '''
+    Cached and conditional json responses of film documents, for views
+    defining get_film_ids() and get_cache_key() of the requested films.
+    '''
     model = Filmwork
     http_method_names = ['get']
+    # a cached body is served once its etag is checked against the db;
+    # views whose validators cost more queries than they save serve it
+    # under the etag stored along, relying on eviction alone
+    validate_cached = True
 
-    def _aggregate_person(self, role):
-        return ArrayAgg('persons__full_name',
-                        filter=Q(personfilmwork__role=role),
-                        distinct=True)
+    def get_fields(self):
+        # ?fields=id,title selects only the listed document fields
+        fields = self.request.GET.get('fields')
+        if not fields:
+            return None
+        fields = tuple(dict.fromkeys(
+            name.strip() for name in fields.split(',') if name.strip()))
+        unknown = set(fields) - set(DOCUMENT_FIELDS)
+        if unknown:
+            raise BadRequest(_('Unknown fields: ') + ', '.join(unknown))
+        return fields
 
-    def get_queryset(self):
-        # Return films, annotaed with actors/genres
-        return Filmwork.objects.annotate(
-            actors = self._aggregate_person('actor'),
-            directors = self._aggregate_person('director'),
-            writers=self._aggregate_person('writer')
-        ).values(
-            'id','title','description','creation_date',
-            'rating','type','actors','writers','directors',
-                  genre=ArrayAgg('genres__name',
-                    filter=Q(genres__name__isnull=False),
-                    distinct = True))
+    def get_films(self, ids):
+        # Ready documents of the read model, keeping order of ids;
+        # json text from postgres goes to the response untouched
+        return [RawJSON(film.encode())
+                for film in get_documents(
+                    ids, raw=True, fields=self.get_fields())]
+
+    def get_etag_seed(self):
+        return self.request.get_full_path()
+
+    def get_validators(self):
+        # Documents are rebuilt on any change of a film or its relations,
+        # so their timestamps validate responses without aggregating
+        ids = self.get_film_ids()
+        stamps = get_stamps(ids)
+
+        digest = hashlib.md5(self.get_etag_seed().encode())
+        for id in ids:
+            if id in stamps:
+                digest.update(f'{id}:{stamps[id].isoformat()}'.encode())
+        last_modified = max(stamps.values()) if stamps else None
+        return f'"{digest.hexdigest()}"', last_modified
+
+    def get(self, request, *args, **kwargs):
+        # Serve rendered json from cache, signals evict changed films
+        key, variant = self.get_cache_key(), ','.join(self.get_fields() or ())
+        if self.validate_cached:
+            etag, last_modified = self.get_validators()
+            content = get_response(key, variant, etag)[1]
+        else:
+            etag, content = get_response(key, variant)
+            last_modified = None
+            if content is None:
+                etag, last_modified = self.get_validators()
+        last_modified = last_modified and int(last_modified.timestamp())
+
+        # Answer If-None-Match/If-Modified-Since before any rendering
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None and content is not None:
+            response = HttpResponse(content, content_type='application/json')
+            response['X-Cache'] = 'HIT'
+        elif response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code == 200:
+                set_response(key, response.content, variant, etag)
+            response['X-Cache'] = 'MISS'
+
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
 
     def render_to_response(self, context, **response_kwargs):
-        return JsonResponse(context)
+        return HttpResponse(dumps(context), content_type='application/json')
 
 class MoviesListApi(MoviesApiMixin, ListView):
+    paginate_by = 50
+    paginator_class = EstimatedCountPaginator
+    cursor_ordering = ('updated_at', 'id')
+    # validating a page takes its count, page and stamps queries, while
+    # every change of a film evicts all the pages
+    validate_cached = False
 
-    def get_context_data(self, **kwargs):
+    def get_cache_key(self):
+        return page_key(self.request.GET)
+
+    @cached_property
+    def filters(self):
+        form = MoviesFilterForm(self.request.GET)
+        if not form.is_valid():
+            raise BadRequest(form.errors.as_text())
+        return form
+
+    def get_film_queryset(self):
+        return self.filters.filter_queryset(Filmwork.objects.all())
+
+    def get_queryset(self):
+        # Pages are cut from bare film ids first, with a stable order
+        # for LIMIT/OFFSET; documents are then read for one page only
+        return self.get_film_queryset().order_by(
+            *self.filters.get_ordering(('id',))).values_list('id', flat=True)
+
+    def get_paginator(self, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True, **kwargs):
+        # Count plain film_work rows, not the aggregated join
+        return super().get_paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            count_queryset=self.get_film_queryset(), **kwargs)
+
+    def get_cursor_page(self):
+        # ?cursor= opts into keyset paging, empty value means the first page
+        paginator = CursorPaginator(
+            self.get_film_queryset(),
+            self.get_paginate_by(None),
+            ordering=self.filters.get_ordering(self.cursor_ordering))
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise BadRequest(_('Invalid cursor'))
+
+        return page.object_list, {
+            'next_cursor': page.next_cursor,
+        }
+
+    @cached_property
+    def page(self):
+        'film ids of the requested page and the page metadata'
+        if 'cursor' in self.request.GET:
+            return self.get_cursor_page()
+
+        queryset = self.get_queryset()
         paginator, page, queryset, is_paginated = self.paginate_queryset(
-                list(self.get_queryset()), 50)
+                queryset, self.get_paginate_by(queryset))
 
-        page = paginator.get_page(self.request.GET.get('page'))
         prev = page.previous_page_number() if page.has_previous() else None
         next = page.next_page_number() if page.has_next() else None
 
-        context = {
+        return list(queryset), {
             'count':  paginator.count,
             'total_pages': paginator.num_pages,
             'prev': prev,
             'next': next,
-            'results': queryset,
         }
-        return context
+
+    def get_film_ids(self):
+        return self.page[0]
+
+    def get_etag_seed(self):
+        # count and neighbour pages change along with the catalog
+        return super().get_etag_seed() + repr(self.page[1])
+
+    def get_validators(self):
+        # films dropped from the page or shifted into it may leave the max
+        # stamp as it was, only the etag covers the page membership
+        etag, last_modified = super().get_validators()
+        return etag, None
+
+    def get_context_data(self, **kwargs):
+        ids, context = self.page
+        return {
+            **context,
+            'results': self.get_films(ids),
+        }
 
 
 class MoviesDetailApi(MoviesApiMixin, DetailView):
 
+    def get_cache_key(self):
+        return film_key(self.kwargs['pk'])
+
+    def get_film_ids(self):
+        return [self.kwargs['pk']]
+
+    def get_validators(self):
+        etag, last_modified = super().get_validators()
+        if last_modified is None:
+            raise Http404(_('No film found matching the query'))
+        return etag, last_modified
+
+    def get_object(self, queryset=None):
+        films = self.get_films(self.get_film_ids())
+        if not films:
+            raise Http404(_('No film found matching the query'))
+        return films[0]
+
     def get_context_data(self, **kwargs):
         return kwargs['object']
+
+
+class MoviesExportApi(View):
+    http_method_names = ['get']
+    chunk_size = 500
+
+    def get(self, request, *args, **kwargs):
+        queryset = Filmwork.objects.order_by('id')
+
+        # Relation changes bump only the document, not the film itself
+        updated_since = request.GET.get('updated_since')
+        if updated_since:
+            # takes a 'Z' suffix too, unlike fromisoformat before 3.11
+            try:
+                updated_since = parse_datetime(updated_since)
+            except ValueError:
+                updated_since = None
+            if updated_since is None:
+                return HttpResponseBadRequest(_('Invalid updated_since'))
+            if timezone.is_naive(updated_since):
+                updated_since = timezone.make_aware(updated_since)
+            queryset = queryset.filter(
+                Q(updated_at__gte=updated_since) |
+                Q(document__updated_at__gte=updated_since))
+
+        # iterator() reads ids through a server-side cursor
+        ids = queryset.values_list('id', flat=True).iterator(
+            chunk_size=self.chunk_size)
+        return StreamingHttpResponse(
+            self.stream(ids), content_type='application/x-ndjson')
+
+    def stream(self, ids):
+        while True:
+            chunk = list(islice(ids, self.chunk_size))
+            if not chunk:
+                break
+            for film in get_documents(chunk, raw=True):
+                yield film.encode() + b'\n'
+
+
+SEARCH_PAGE_SIZE = 50
+
+
+async def movies_search(request):
+    '''
+    Full-text search over the elastic index. Popular queries are answered
+    from the cache for a few seconds, the index is not evicted on changes.
+    A function view, as django 4.0 runs no async methods of class views.
+    '''
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    form = SearchForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    key = search_key(request.GET)
+    content = await cache.aget(key)
+    if content is not None:
+        response = HttpResponse(content, content_type='application/json')
+        response['X-Cache'] = 'HIT'
+        return response
+
+    try:
+        body = build_search(form.cleaned_data,
+                            form.cleaned_data['page_size'] or SEARCH_PAGE_SIZE)
+    except InvalidCursor:
+        raise BadRequest(_('Invalid cursor'))
+    try:
+        content = dumps(await search(body))
+    except InvalidSearch:
+        raise BadRequest(_('Invalid search'))
+    except SearchUnavailable:
+        return HttpResponse(_('Search is unavailable'), status=503)
+
+    await cache.aset(key, content, settings.SEARCH_CACHE_TIMEOUT)
+    response = HttpResponse(content, content_type='application/json')
+    response['X-Cache'] = 'MISS'
+    return response
@@ -7,3 +7,7 @@ class MoviesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'movies'
     verbose_name = _('movies')
+
+    def ready(self):
+        # Подключаем обработчики сигналов моделей
+        from movies import signals  # noqa: F401
@@ -0,0 +1,115 @@
+import json
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q, TextField
+from django.db.models.fields.json import KeyTransform
+from django.db.models.functions import Cast, JSONObject
+
+from movies.models import Filmwork, FilmworkDocument
+
+#
+# Сборка денормализованных документов фильмов для API
+#
+
+# поля документа и те из них, что хранятся в самой таблице film_work
+DOCUMENT_FIELDS = ('id', 'title', 'description', 'creation_date', 'rating',
+                   'type', 'actors', 'writers', 'directors', 'genre')
+FILM_WORK_FIELDS = DOCUMENT_FIELDS[:6]
+
+
+def _aggregate_person(role):
+    return ArrayAgg('persons__full_name',
+                    filter=Q(personfilmwork__role=role),
+                    distinct=True)
+
+
+def film_queryset():
+    # Return films, annotaed with actors/genres
+    return Filmwork.objects.annotate(
+        actors=_aggregate_person('actor'),
+        directors=_aggregate_person('director'),
+        writers=_aggregate_person('writer')
+    ).values(
+        'id', 'title', 'description', 'creation_date',
+        'rating', 'type', 'actors', 'writers', 'directors',
+        genre=ArrayAgg('genres__name',
+                       filter=Q(genres__name__isnull=False),
+                       distinct=True))
+
+
+def build_documents(ids, chunk_size=500):
+    'aggregate documents for the film ids and store them in the read model'
+    ids = list(ids)
+    documents = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        built = {film['id']: film
+                 for film in film_queryset().filter(id__in=chunk)}
+
+        # deleted films just drop out of the read model
+        with transaction.atomic():
+            FilmworkDocument.objects.filter(pk__in=chunk).delete()
+            FilmworkDocument.objects.bulk_create([
+                FilmworkDocument(film_work_id=id, document=document)
+                for id, document in built.items()
+            ], ignore_conflicts=True)
+        documents.update(built)
+    return documents
+
+
+def rebuild_documents(chunk_size=500):
+    'rebuild the whole read model, e.g. after a raw sql import'
+    ids = Filmwork.objects.values_list('id', flat=True).iterator(
+        chunk_size=chunk_size)
+    chunk = []
+    for id in ids:
+        chunk.append(id)
+        if len(chunk) == chunk_size:
+            build_documents(chunk, chunk_size)
+            chunk = []
+    build_documents(chunk, chunk_size)
+
+
+def get_documents(ids, raw=False, fields=None):
+    '''
+    Read model documents in the order of ids, missing ones built on the fly.
+    With raw=True documents come as json text rendered by postgres itself.
+    Only given fields are selected: plain film_work columns are read from
+    the film_work table directly, others are cut out of stored documents.
+    '''
+    if fields and set(fields) <= set(FILM_WORK_FIELDS):
+        queryset = Filmwork.objects.filter(pk__in=ids)
+        document = JSONObject(**{name: F(name) for name in fields})
+    else:
+        queryset = FilmworkDocument.objects.filter(pk__in=ids)
+        document = F('document')
+        if fields:
+            document = JSONObject(**{name: KeyTransform(name, 'document')
+                                     for name in fields})
+    if raw:
+        document = Cast(document, TextField())
+
+    documents = dict(queryset.values_list('pk', document))
+    missing = [id for id in ids if id not in documents]
+    if missing and queryset.model is FilmworkDocument:
+        built = build_documents(missing)
+        for id, film in built.items():
+            if fields:
+                film = {name: film[name] for name in fields}
+            documents[id] = json.dumps(film, cls=DjangoJSONEncoder) \
+                if raw else film
+    return [documents[id] for id in ids if id in documents]
+
+
+def get_stamps(ids):
+    'last rebuild time of the documents for ids, missing ones built first'
+    stamps = dict(FilmworkDocument.objects.filter(
+        pk__in=ids).values_list('pk', 'updated_at'))
+    missing = [id for id in ids if id not in stamps]
+    if missing:
+        build_documents(missing)
+        stamps.update(FilmworkDocument.objects.filter(
+            pk__in=missing).values_list('pk', 'updated_at'))
+    return stamps
@@ -0,0 +1,530 @@
+import json
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import astuple
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import namedtuple
+from itertools import cycle
+
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import Client
+
+from movies.documents import build_documents, film_queryset
+from movies.models import Filmwork, Person, Genre, FilmworkDocument
+from movies.models import GenreFilmwork, PersonFilmwork
+from movies.api.v1.serializers import RawJSON, backends_map, dumps
+from movies.api.v1.search import close_client
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks hot paths of the app on a generated dataset'
+
+    # args and corresponding methods to run the benchmark
+    cases_map = {
+        'list_query': 'bench_list_query',
+        'serializers': 'bench_serializers',
+        'import': 'bench_import',
+        'rows': 'bench_rows',
+        'merge': 'bench_merge',
+        'bulk': 'bench_bulk',
+        'search': 'bench_search',
+    }
+    # cases generating data in db, which is rolled back afterwards
+    dataset_cases = ('list_query',)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--case', type=str, required=True, choices=Command.cases_map,
+            help='Name of a benchmark to run')
+        parser.add_argument(
+            '--films', type=int, default=10000,
+            help='Number of film_work to generate for the benchmark')
+        parser.add_argument(
+            '--cast', type=int, default=10,
+            help='Number of persons to cast into each generated film_work')
+        parser.add_argument(
+            '--page', type=int, default=1,
+            help='Page number of the movies list to benchmark')
+        parser.add_argument(
+            '--sqlite', type=str,
+            help='SQLite db to import, generated from --films if not set')
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='Number of runs of in-memory benchmarks')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep generated dataset in db instead of rolling it back')
+
+    def populate(self, films, cast):
+        # Bulk generate a catalog, mimicking the shape of imported data
+        genres = [Genre(name=f'genre {i}') for i in range(20)]
+        persons = [Person(full_name=f'person {i}')
+                   for i in range(max(films // 2, cast))]
+        film_works = [
+            Filmwork(
+                title=f'film {i}',
+                description=f'description of film {i}',
+                creation_date=date(1970, 1, 1) + timedelta(days=i % 20000),
+                rating=round(random.random() * 10, 1),
+                type=random.choice(['movie', 'tv_show']),
+            ) for i in range(films)
+        ]
+        roles = cycle(['actor'] * 3 + ['writer', 'director'])
+        Genre.objects.bulk_create(genres, batch_size=5000)
+        Person.objects.bulk_create(persons, batch_size=5000)
+        Filmwork.objects.bulk_create(film_works, batch_size=5000)
+        GenreFilmwork.objects.bulk_create([
+            GenreFilmwork(film_work=fw, genre=genre)
+            for fw in film_works for genre in random.sample(genres, 2)
+        ], batch_size=5000)
+        PersonFilmwork.objects.bulk_create([
+            PersonFilmwork(film_work=fw, person=person, role=next(roles))
+            for fw in film_works for person in random.sample(persons, cast)
+        ], batch_size=5000)
+
+        # fresh statistics, otherwise planner guesses on empty tables
+        with connection.cursor() as cursor:
+            for model in (Filmwork, Person, Genre,
+                          GenreFilmwork, PersonFilmwork):
+                cursor.execute('ANALYZE ' +
+                               connection.ops.quote_name(model._meta.db_table))
+        self.stdout.write(self.style.SUCCESS(
+            f'### Bench: generated {films} film_work, cast of {cast} each'))
+
+    def explain(self, label, queryset):
+        plan = queryset.explain(analyze=True, buffers=True)
+        if self.verbosity > 1:
+            self.stdout.write(plan)
+        found = re.search(r'Execution Time: ([\d.]+) ms', plan)
+        elapsed = float(found.group(1)) if found else 0.0
+        self.stdout.write(self.style.WARNING(
+            f'### Bench: {label}: {elapsed:.3f} ms'))
+        return elapsed
+
+    def bench_list_query(self, options):
+        self.populate(options['films'], options['cast'])
+        offset = (options['page'] - 1) * 50
+
+        # single phase: aggregate the whole catalog, then cut the page
+        single = film_queryset().order_by('id')[offset:offset + 50]
+        before = self.explain('single-phase aggregated page', single)
+
+        # two phases: cut the page of ids, then aggregate it only
+        page = Filmwork.objects.order_by('id').values_list(
+            'id', flat=True)[offset:offset + 50]
+        after = self.explain('phase 1: page of ids', page)
+        after += self.explain(
+            'phase 2: aggregate page ids',
+            film_queryset().filter(id__in=list(page)))
+
+        start = time.perf_counter()
+        list(single)
+        wall_before = time.perf_counter() - start
+        start = time.perf_counter()
+        list(film_queryset().filter(id__in=list(page)))
+        wall_after = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'### Bench: server time {before:.3f} ms -> {after:.3f} ms, '
+            f'wall time {wall_before * 1000:.3f} ms -> '
+            f'{wall_after * 1000:.3f} ms'))
+
+        # read model: phase 2 is a primary key lookup of ready documents
+        build_documents(list(page))
+        self.explain(
+            'phase 2: read model documents',
+            FilmworkDocument.objects.filter(
+                pk__in=list(page)).values_list('pk', 'document'))
+
+    def populate_sqlite(self, path, films, cast):
+        # SQLite catalog in the shape of the one shipped for dbimport
+        now = '2021-06-16 20:14:09.221838+00'
+        conn = sqlite3.connect(path)
+        conn.executescript('''
+            CREATE TABLE film_work (id TEXT PRIMARY KEY, title TEXT,
+                description TEXT, creation_date DATE, file_path TEXT,
+                rating FLOAT, type TEXT, created_at TIMESTAMP,
+                updated_at TIMESTAMP);
+            CREATE TABLE genre (id TEXT PRIMARY KEY, name TEXT,
+                description TEXT, created_at TIMESTAMP,
+                updated_at TIMESTAMP);
+            CREATE TABLE person (id TEXT PRIMARY KEY, full_name TEXT,
+                created_at TIMESTAMP, updated_at TIMESTAMP);
+            CREATE TABLE genre_film_work (id TEXT PRIMARY KEY,
+                film_work_id TEXT, genre_id TEXT, created_at TIMESTAMP);
+            CREATE TABLE person_film_work (id TEXT PRIMARY KEY,
+                film_work_id TEXT, person_id TEXT, role TEXT,
+                created_at TIMESTAMP);
+        ''')
+        genres = [str(uuid.uuid4()) for _ in range(20)]
+        persons = [str(uuid.uuid4()) for _ in range(max(films // 2, cast))]
+        conn.executemany('INSERT INTO genre VALUES (?, ?, ?, ?, ?)', (
+            (id, f'genre {i}', f'about genre {i}', now, now)
+            for i, id in enumerate(genres)))
+        conn.executemany('INSERT INTO person VALUES (?, ?, ?, ?)', (
+            (id, f'person {i}', now, now) for i, id in enumerate(persons)))
+
+        roles = cycle(['actor'] * 3 + ['writer', 'director'])
+        for start in range(0, films, 10000):
+            ids = [str(uuid.uuid4()) for _ in range(start,
+                                                    min(start + 10000, films))]
+            conn.executemany(
+                'INSERT INTO film_work VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                    # every other film lacks data, filled on import
+                    (id, f'film {id}', 'some\ttabbed\nmultiline text',
+                     '2000-01-01', None, 5.5, 'movie', now, now)
+                    if n % 2 else (id, f'film {id}', None, None, None,
+                                   None, 'movie', now, now)
+                    for n, id in enumerate(ids)))
+            conn.executemany(
+                'INSERT INTO genre_film_work VALUES (?, ?, ?, ?)', (
+                    (str(uuid.uuid4()), id, genre, now)
+                    for id in ids for genre in random.sample(genres, 2)))
+            conn.executemany(
+                'INSERT INTO person_film_work VALUES (?, ?, ?, ?, ?)', (
+                    (str(uuid.uuid4()), id, person, next(roles), now)
+                    for id in ids for person in random.sample(persons, cast)))
+        conn.commit()
+        conn.close()
+
+    def bench_import(self, options):
+        sys.path.append('../03_sqlite_to_postgres')
+        import db
+        from dataclass import FilmWork, Person, Genre
+        from dataclass import GenreFilmWork, PersonFilmWork
+
+        table_map = {
+            'film_work': FilmWork,
+            'person': Person,
+            'genre': Genre,
+            'genre_film_work': GenreFilmWork,
+            'person_film_work': PersonFilmWork,
+        }
+        path = options['sqlite']
+        if not path:
+            path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+            self.populate_sqlite(path, options['films'], options['cast'])
+            self.stdout.write(self.style.SUCCESS(
+                f'### Bench: generated {path} with {options["films"]} '
+                f'film_work, cast of {options["cast"]} each'))
+
+        results = {}
+        for method, chunk_size in (('insert', 1000), ('copy', 10000)):
+            schema = f'bench_{method}'
+            with db.sqlite_manager(path) as sqlt, \
+                    db.postgres_manager() as psg:
+                # empty copies of content tables, dropped afterwards
+                with psg.cursor() as cursor:
+                    cursor.execute(f'CREATE SCHEMA {schema};')
+                    for table in table_map:
+                        cursor.execute(
+                            f'CREATE TABLE {schema}.{table} '
+                            f'(LIKE content.{table} INCLUDING ALL);')
+                psg.commit()
+                try:
+                    loader = db.SQLiteLoader(sqlt)
+                    saver = db.PostgresSaver(
+                        psg, chunk_size=chunk_size, schema=schema)
+                    start = time.perf_counter()
+                    for table, target in table_map.items():
+                        getattr(saver, f'{method}_table')(
+                            table, loader.fetch_table(table, target), target)
+                    elapsed = time.perf_counter() - start
+                    rows = sum(loader.len_table(t) for t in table_map)
+                finally:
+                    psg.rollback()
+                    with psg.cursor() as cursor:
+                        cursor.execute(f'DROP SCHEMA {schema} CASCADE;')
+                    psg.commit()
+
+            results[method] = elapsed
+            self.stdout.write(self.style.WARNING(
+                f'### Bench: {method}: {rows} rows in {elapsed:.3f} s, '
+                f'{rows / elapsed:.0f} rows/s'))
+        self.stdout.write(self.style.SUCCESS(
+            f'### Bench: copy is {results["insert"] / results["copy"]:.1f}x '
+            'faster than insert'))
+
+    def bench_rows(self, options):
+        sys.path.append('../03_sqlite_to_postgres')
+        import dataclass
+        from dataclass import FilmWork
+
+        path = options['sqlite']
+        if not path:
+            path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+            self.populate_sqlite(path, options['films'], 1)
+        conn = sqlite3.connect(path)
+        columns = [column[0] for column in conn.execute(
+            'SELECT * FROM film_work LIMIT 0').description]
+        rows = conn.execute('SELECT * FROM film_work').fetchall()
+        conn.close()
+
+        # per row cost of a missing description, as generated before
+        dataclass.filler_pool('film_description')
+        fake = self.timeit(
+            'faker text', lambda: dataclass.fake.text(max_nb_chars=100),
+            options['repeat'])
+        pool = self.timeit(
+            'pooled text', lambda: dataclass.filler('film_description'),
+            options['repeat'])
+        self.stdout.write(self.style.SUCCESS(
+            f'### Bench: pooled filler is {fake / pool:.0f}x faster'))
+
+        converters = {
+            'dataclass': lambda row: astuple(
+                FilmWork(**dict(zip(columns, row)))),
+            'tuple': dataclass.row_converter(FilmWork, columns),
+            'tuple, no filler': dataclass.row_converter(
+                FilmWork, columns, fill=False),
+        }
+        for label, convert in converters.items():
+            start = time.perf_counter()
+            for row in rows:
+                convert(row)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.WARNING(
+                f'### Bench: {label}: {len(rows) / elapsed:.0f} rows/s'))
+
+    def bench_merge(self, options):
+        sys.path.append('../03_sqlite_to_postgres')
+        import db
+
+        # rows of the enrichment join: the cast repeated for every genre
+        Row = namedtuple('Row', ['fw_id', 'title', 'description', 'rating',
+                                 'role', 'pid', 'full_name', 'gname'])
+        Film = namedtuple('Film', ['id'])
+        roles = cycle(['actor'] * 3 + ['writer', 'director'])
+        genres = [f'genre {i}' for i in range(5)]
+        films, rows = [], []
+        for _ in range(options['films']):
+            film = uuid.uuid4()
+            films.append(Film(film))
+            for _ in range(options['cast']):
+                role, pid = next(roles), uuid.uuid4()
+                rows.extend(Row(film, 'title', 'description', 5.5, role, pid,
+                                f'person {pid}', genre) for genre in genres)
+
+        connection.ensure_connection()
+        enricher = db.PostgresEnricher('film_work', connection.connection)
+        enricher.init_target(films)
+        start = time.perf_counter()
+        enricher.merge_target(rows)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.WARNING(
+            f'### Bench: merge: {len(rows)} rows of {len(films)} films, '
+            f'cast of {options["cast"]}: {len(rows) / elapsed:.0f} rows/s, '
+            f'{elapsed * 1000 / len(films):.3f} ms per film'))
+
+    def stand_in_elastic(self, latency):
+        'local http server answering as elasticsearch does to bulk/search'
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive connections, as elasticsearch has; headers and
+            # body go in separate writes, not to be held by nagle
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def reply(self, body):
+                body = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('X-Elastic-Product', 'Elasticsearch')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self.reply({'version': {'number': '7.17.0',
+                                        'build_flavor': 'default'},
+                            'tagline': 'You Know, for Search'})
+
+            do_HEAD = do_GET
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.path.split('?')[0].endswith('/_search'):
+                    return self.search(json.loads(body))
+                # action and source lines go in pairs
+                actions = body.splitlines()[::2]
+                time.sleep(latency)
+                self.reply({'took': 1, 'errors': False, 'items': [
+                    {'index': {'_id': json.loads(action)['index']['_id'],
+                               'status': 201}}
+                    for action in actions]})
+
+            def search(self, body):
+                # a full page of films, to be paged through with search_after
+                after = body.get('search_after', [0, ''])[0]
+                time.sleep(latency)
+                self.reply({'took': 1, 'timed_out': False, 'hits': {
+                    'total': {'value': 10000, 'relation': 'gte'},
+                    'hits': [{
+                        '_index': 'movies', '_id': str(i), '_score': 1.0,
+                        '_source': {'id': str(i), 'title': f'film {i}',
+                                    'imdb_rating': 5.5, 'genre': ['genre']},
+                        'sort': [after + i + 1, str(i)],
+                    } for i in range(body['size'])]}})
+
+            def log_message(self, *args):
+                pass
+
+        # a process of its own, not to share the GIL with the client
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        process = multiprocessing.Process(
+            target=server.serve_forever, daemon=True)
+        process.start()
+        server.socket.close()
+        return server.server_port, process
+
+    def bench_bulk(self, options):
+        sys.path.append('../05_elastic')
+        import elastic
+        from elasticsearch import helpers
+
+        # time spent by elasticsearch on a bulk request
+        latency = 0.02
+        port, server = self.stand_in_elastic(latency)
+        os.environ['ELASTIC_HOST'], os.environ['ELASTIC_PORT'] = \
+            '127.0.0.1', str(port)
+
+        docs = [{
+            'id': str(uuid.uuid4()),
+            'title': f'film {i}',
+            'description': 'description ' * 20,
+            'imdb_rating': 5.5,
+            'director': 'director',
+            'actors_names': 'actor,' * options['cast'],
+            'writers_names': 'writer,',
+            'actors': [{'id': str(uuid.uuid4()), 'name': 'actor'}
+                       for _ in range(options['cast'])],
+            'writers': [{'id': str(uuid.uuid4()), 'name': 'writer'}],
+            'genre': ['genre'],
+        } for i in range(options['films'])]
+
+        def legacy():
+            # json encoded sources, one list and a single thread
+            manager = elastic.EsManager('movies', chunk_size=500)
+            helpers.bulk(manager.es_client, [{
+                '_index': 'movies', '_id': doc['id'],
+                '_source': json.dumps(doc)} for doc in docs])
+
+        runs = {'bulk': legacy}
+        for threads in (1, 4, 8):
+            manager = elastic.EsManager(
+                'movies', chunk_size=500, threads=threads)
+            runs[f'populate_index, {threads} threads'] = \
+                lambda manager=manager: manager.populate_index(iter(docs))
+
+        try:
+            for label, run in runs.items():
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                self.stdout.write(self.style.WARNING(
+                    f'### Bench: {label}: '
+                    f'{options["films"] / elapsed:.0f} docs/s'))
+        finally:
+            server.terminate()
+
+    def bench_search(self, options):
+        # time spent by elasticsearch on a search request
+        latency = 0.005
+        port, server = self.stand_in_elastic(latency)
+        os.environ['ELASTIC_HOST'], os.environ['ELASTIC_PORT'] = \
+            '127.0.0.1', str(port)
+
+        # through the whole request handler, as served under WSGI
+        client = Client()
+
+        def get(params):
+            response = client.get('/api/v1/search/', params)
+            if response.status_code != 200:
+                raise CommandError(f'Search failed: {response.content}')
+            return response
+
+        repeat = options['repeat']
+        try:
+            # every query is new for a miss, the same one is cached
+            queries = iter(range(repeat))
+            self.timeit('search, cache miss',
+                        lambda: get({'query': f'film {next(queries)}'}),
+                        repeat)
+            page = json.loads(get({'query': 'film'}).content)
+            get({'query': 'film', 'cursor': page['next_cursor']})
+            self.timeit('search, cache hit',
+                        lambda: get({'query': 'film'}), repeat)
+        finally:
+            close_client()
+            server.terminate()
+
+    def timeit(self, label, func, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = (time.perf_counter() - start) / repeat
+        self.stdout.write(self.style.WARNING(
+            f'### Bench: {label}: {elapsed * 1000:.3f} ms'))
+        return elapsed
+
+    def bench_serializers(self, options):
+        # a list page of documents, as the read model serves them
+        films = [{
+            'id': uuid.uuid4(),
+            'title': f'film {i}',
+            'description': 'description ' * 20,
+            'creation_date': date(1970, 1, 1) + timedelta(days=i),
+            'rating': round(random.random() * 10, 1),
+            'type': 'movie',
+            'actors': [f'actor {i} {j}' for j in range(options['cast'])],
+            'writers': [f'writer {i}'],
+            'directors': [f'director {i}'],
+            'genre': ['Drama', 'Comedy'],
+        } for i in range(50)]
+        context = {'count': 1000, 'total_pages': 20, 'prev': None,
+                   'next': 2, 'results': films}
+        repeat = options['repeat']
+
+        baseline = self.timeit(
+            'stdlib json, DjangoJSONEncoder (JsonResponse)',
+            lambda: json.dumps(context, cls=DjangoJSONEncoder).encode(),
+            repeat)
+        for name, backend in backends_map.items():
+            if backend is None:
+                self.stdout.write(f'### Bench: {name} is not installed')
+                continue
+            self.timeit(f'{name} backend',
+                        lambda: dumps(context, backend), repeat)
+
+        # postgres renders each document, python only splices bytes
+        raw = dict(context, results=[
+            RawJSON(json.dumps(film, cls=DjangoJSONEncoder).encode())
+            for film in films])
+        passthrough = self.timeit(
+            'raw postgres json pass-through', lambda: dumps(raw), repeat)
+        self.stdout.write(self.style.SUCCESS(
+            f'### Bench: pass-through is {baseline / passthrough:.1f}x '
+            'faster than JsonResponse encoding'))
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        bench = getattr(self, Command.cases_map[options['case']])
+        if options['case'] not in Command.dataset_cases:
+            bench(options)
+            return
+
+        # generated data is rolled back, unless asked to keep it
+        with transaction.atomic():
+            bench(options)
+            if not options['keep']:
+                transaction.set_rollback(True)
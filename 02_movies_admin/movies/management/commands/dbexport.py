@@ -3,10 +3,11 @@ from math import prod
 import os, sys
 from pprint import pprint
 
+from itertools import chain
 from time import sleep
 from datetime import date, datetime
 from django.db import transaction
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from movies.models import Filmwork, Person, Genre
 
@@ -19,6 +20,8 @@ from backoff import backoff
 sys.path.append('../03_sqlite_to_postgres')
 import db
 
+SCHEMA_FILE = '../05_elastic/elastic.schema.json'
+
 
 class Command(BaseCommand):
     help = 'Export database updates to external services, like search or messaging'
@@ -32,74 +35,142 @@ class Command(BaseCommand):
             help='The daemon would export db updates each <interval> sec.')
         parser.add_argument(
             '--exportafter', type=datetime.fromisoformat,
-            help='Records modified after date(iso) would be exported. Override state')
+            help='Records modified after date(iso) would be exported, '
+                 'even if indexed unchanged. Override state')
+        parser.add_argument(
+            '--full-reindex', action='store_true',
+            help='Rebuild the whole index aside and swap it in when done')
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help='Number of threads sending bulk requests to elasticsearch')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Documents sent to elasticsearch in one bulk request')
+        parser.add_argument(
+            '--chunk-bytes', type=int, default=10 * 1024 * 1024,
+            help='Size limit of one bulk request to elasticsearch, in bytes')
+        parser.add_argument(
+            '--itersize', type=int, default=2000,
+            help='Rows fetched from postgres server-side cursors at once')
 
     #@backoff()
-    def _etl_process(self, model):
-        with db.postgres_manager() as psg:
-            producer = db.PostgresProducer(model, psg, chunk_size=500)
-
-            # get direct updates in requested model
+    def _etl_process(self, postgres, esmanager, hashes, startdate=None,
+                     itersize=None, full_reindex=False):
+        'one export cycle, False when some docs failed and it is to be redone'
+        with postgres.cycle() as psg:
+            # films changed directly or through persons, genres and links,
+            # each one once per cycle
+            producer = db.PostgresChangeDetector(
+                psg, startdate=startdate, chunk_size=500, itersize=itersize,
+                full=full_reindex)
             syncfrom = producer.get_startdate()
             src = producer.produce()
-            num = producer.num_extracted()
 
             self.stdout.write(self.style.SUCCESS(
-                    f'### ETL: sync {model} from {syncfrom}'))
-
-            # process transitive updates if working model isn't final
-            enricher = db.PostgresEnricher(model, psg, chunk_size=500)
-
-            target = enricher.find_target(src) if model != 'film_work' else src
-            num = enricher.num_extracted() if model != 'film_work' else num
+                    f'### ETL: sync changes from {syncfrom}'))
+
+            enricher = db.PostgresEnricher(
+                'film_work', psg, chunk_size=500, itersize=itersize)
+
+            # full reindex loads a new index, readers keep the old one
+            index = esmanager.build_index(SCHEMA_FILE) \
+                if full_reindex else None
+
+            # each chunk of affected films is enriched, merged to match
+            # expected data schema and streamed to elasticsearch, the
+            # next one is fetched as bulk requests drain the queue
+            # documents identical to the indexed ones are not sent again,
+            # unless a start date is given to resend them
+            if full_reindex:
+                hashes.clear()
+            indexed, failed = esmanager.populate_index(
+                hashes.changed(chain.from_iterable(enricher.stream(src)),
+                               force=startdate is not None),
+                index=index)
 
-            # start building elsatic dicts
-            enricher.init_target(target)
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'### ETL: related film_work: found {num} references'
-                ))
-            
-            # enrich target updates
-            to_merge = enricher.enrich_target()
             self.stdout.write(
                 self.style.SUCCESS(
-                    '### ETL: merged & enriched total: ' +
-                     f'{enricher.total_uids} records\n'
+                    '### ETL: merged, enriched & indexed total: ' +
+                     f'{indexed} of {enricher.total_uids} records, ' +
+                     f'{hashes.skipped} unchanged skipped, ' +
+                     f'{postgres.connects} postgres connects so far\n'
                 ))
-            
-            # merge enriched rows to match expected data schema
-            enricher.merge_target(to_merge)
-            
-            # load to elasticsearch
-            esmanager = elastic.EsManager('movies', chunk_size=500)
-
-            # esmanager.delete_index()
-            # esmanager.create_schema('../05_elastic/elastic.schema.json')
+            if failed:
+                hashes.rollback()
+                # the whole cycle is retried, indexing the same doc is safe
+                self.stdout.write(
+                    self.style.ERROR(
+                        f'### ETL: {len(failed)} records failed to index, '
+                        'keeping sync pointer'))
+                if index:
+                    esmanager.delete_index(index)
+                return False
+
+            if index:
+                esmanager.publish_index(index, SCHEMA_FILE)
+                self.stdout.write(
+                    self.style.SUCCESS(f'### ETL: switched to index {index}'))
 
-            for chunk in db.chunks(enricher.target.values(), chunk_size=500):
-                changes = list(chunk)
-                esmanager.populate_index(changes)
-            
-            # update sync pointer
-            producer.set_startdate()
+            # move watermarks only after every film has been indexed
+            hashes.commit()
+            producer.commit()
             self.stdout.write(
                 self.style.SUCCESS(
                         f'### ETL: written sync pointer: {producer.get_startdate()}'))
             
             #esmanager.search('Sci-Fi')
+            return True
 
     def handle(self, *args, **options):
-        while True:
-            for model in ['film_work', 'person', 'genre']:
-                self.stdout.write(
-                    self.style.WARNING(f'### ETL: syncing {model}...'))
-                self._etl_process(model)
-
-            if options['d']:
-                self.stdout.write(
-                    self.style.SUCCESS('### ETL: running ETL daemon...')
-                )
-                sleep(options['interval'])
-            else:
-                break
+        startdate = options['exportafter']
+        full_reindex = options['full_reindex']
+        # connections live as long as the daemon does, not a single cycle,
+        # a lost one is dropped and opened again on the next cycle
+        postgres = db.PostgresConnection()
+        esmanager = None
+        hashes = db.DocumentHashes()
+        try:
+            while True:
+                self.stdout.write(self.style.WARNING('### ETL: syncing...'))
+                try:
+                    if esmanager is None:
+                        esmanager = elastic.EsManager(
+                            'movies', chunk_size=options['chunk_size'],
+                            threads=options['threads'],
+                            chunk_bytes=options['chunk_bytes'])
+                    esmanager.check()
+                    done = self._etl_process(
+                        postgres, esmanager, hashes, startdate,
+                        options['itersize'], full_reindex)
+                except db.CONNECTION_ERRORS + elastic.CONNECTION_ERRORS as e:
+                    if not options['d']:
+                        raise
+                    # nothing of the cycle is kept, the overrides apply
+                    # to the next one
+                    hashes.rollback()
+                    postgres.close()
+                    esmanager.close()
+                    esmanager = None
+                    self.stdout.write(self.style.ERROR(
+                        f'### ETL: connection failed, retry next cycle: {e}'))
+                    done = False
+
+                if done:
+                    # the overrides apply to the first complete cycle only
+                    startdate = None
+                    full_reindex = False
+                elif not options['d']:
+                    raise CommandError('Export failed, sync pointer kept')
+
+                if options['d']:
+                    self.stdout.write(
+                        self.style.SUCCESS('### ETL: running ETL daemon...')
+                    )
+                    sleep(options['interval'])
+                else:
+                    break
+        finally:
+            postgres.close()
+            if esmanager is not None:
+                esmanager.close()
+            hashes.close()
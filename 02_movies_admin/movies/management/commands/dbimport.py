@@ -1,9 +1,13 @@
 
+import json
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from django.core.management.base import BaseCommand
 
+from movies.documents import rebuild_documents
+
 
 class Command(BaseCommand):
     help = 'Imports the embedded SQLite database to Django backend'
@@ -13,6 +17,59 @@ class Command(BaseCommand):
             '--sqlite', type=str, required=True,
             help='imports specified SQLite db contents into Django backend'
         )
+        parser.add_argument(
+            '--method', type=str, default='copy',
+            choices=Command.method_map,
+            help='write rows with COPY through a staging table, '
+                 'or with multi-row INSERT statements'
+        )
+        parser.add_argument(
+            '--chunk', type=int,
+            help='number of rows written and committed at once '
+                 '(10000 for copy, 1000 for insert by default)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='number of tables imported at once, each by a process '
+                 'with its own connections'
+        )
+        parser.add_argument(
+            '--no-filler', action='store_true',
+            help='do not fill NULLs of the source with generated values: '
+                 'nullable columns keep them, NOT NULL ones get plain '
+                 'defaults (empty text, zero rating, creation date from '
+                 'created_at or 1900-01-01)'
+        )
+        parser.add_argument(
+            '--report', type=str,
+            help='write per table import stats and verification results '
+                 'to the file as json, instead of the console'
+        )
+        parser.add_argument(
+            '--no-verify', action='store_true',
+            help='skip comparing row counts and checksums with the source'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='ignore checkpoints of an interrupted import, '
+                 'start over from the first row'
+        )
+
+    # args and corresponding PostgresSaver methods to write tables
+    method_map = {
+        'copy': 'copy_table',
+        'insert': 'insert_table',
+    }
+    chunk_map = {
+        'copy': 10000,
+        'insert': 1000,
+    }
+    # tables of a stage are independent, through tables reference
+    # film_work, person and genre and wait for them to be loaded
+    stages = (
+        ('film_work', 'person', 'genre'),
+        ('genre_film_work', 'person_film_work'),
+    )
 
     def handle(self, *args, **options):
         sys.path.append('../03_sqlite_to_postgres')
@@ -21,42 +78,96 @@ class Command(BaseCommand):
         from dataclass import FilmWork, Person, Genre
         from dataclass import GenreFilmWork, PersonFilmWork
 
-        # Установим соединение с БД используя контекстный менеджер with.
-        # В конце блока автоматически закроется курсор (cursor.close())
-        # и соединение (conn.close())
-        with db.sqlite_manager(options['sqlite']) as sqlt:
-            with db.postgres_manager() as psg:
-                loader = db.SQLiteLoader(sqlt)
-                saver = db.PostgresSaver(psg)
-
-                # tables to process and corresponding dataclasses
-                table_map = {
-                    'film_work': FilmWork,
-                    'person': Person,
-                    'genre': Genre,
-                    'genre_film_work': GenreFilmWork,
-                    'person_film_work': PersonFilmWork,
-                }
-
-                start_time = time.time()
-                for key, value in table_map.items():
-                    # Import from SQLite into runtime dataclass
-                    self.stdout.write(
-                        self.style.SUCCESS(f'SQLite: loading {key}')
-                    )
-                    # Get generator cursor for source table rows
-                    rows_producer = loader.fetch_table(key, value)
-                    self.stdout.write(
-                        self.style.SUCCESS(f'Postgres: saving {key}')
-                    )
-                    # Yield chunks from generator to avoid memory overloads
-                    saver.insert_table(key, rows_producer, value)
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'Succesfully inserted \
-                                {loader.len_table(key)} records'
-                        )
-                    )
+        # tables to process and corresponding dataclasses
+        table_map = {
+            'film_work': FilmWork,
+            'person': Person,
+            'genre': Genre,
+            'genre_film_work': GenreFilmWork,
+            'person_film_work': PersonFilmWork,
+        }
+        method = Command.method_map[options['method']]
+        chunk_size = options['chunk'] or Command.chunk_map[options['method']]
+
+        report = {'method': options['method'], 'tables': []}
+        start_time = time.time()
+        for stage in Command.stages:
+            if options['workers'] > 1:
+                # Каждый процесс открывает свои соединения с SQLite и Postgres
+                with ProcessPoolExecutor(options['workers']) as executor:
+                    futures = {
+                        executor.submit(
+                            db.import_table, options['sqlite'], key,
+                            table_map[key], method, chunk_size,
+                            not options['restart'],
+                            not options['no_filler']): key
+                        for key in stage
+                    }
+                    for future in as_completed(futures):
+                        report['tables'].append(self.report(future.result()))
+                continue
+
+            for key in stage:
                 self.stdout.write(
-                    self.style.SUCCESS(f'--- {time.time() - start_time} seconds ---')
+                    self.style.SUCCESS(f'SQLite -> Postgres: loading {key}')
                 )
+                # Yield chunks from generator to avoid memory overloads
+                report['tables'].append(self.report(db.import_table(
+                    options['sqlite'], key, table_map[key],
+                    method, chunk_size, not options['restart'],
+                    not options['no_filler'])))
+        report['seconds'] = round(time.time() - start_time, 3)
+        self.stdout.write(
+            self.style.SUCCESS(f'--- {report["seconds"]} seconds ---')
+        )
+
+        if not options['no_verify']:
+            report['verification'] = [
+                self.verify(db.verify_table(options['sqlite'], key, value))
+                for key, value in table_map.items()
+            ]
+
+        report = json.dumps(report, indent=2)
+        if options['report']:
+            with open(options['report'], 'w') as fp:
+                fp.write(report)
+        else:
+            self.stdout.write(report)
+
+        # checkpoints are kept until all tables are done, the next
+        # import of the same db starts over
+        for key in table_map:
+            db.ImportCheckpoint(options['sqlite'], key).clear()
+
+        # raw sql import bypasses model signals, rebuild api documents
+        self.stdout.write(
+            self.style.SUCCESS('Django backend: rebuilding film documents')
+        )
+        rebuild_documents()
+
+    def report(self, stats):
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Succesfully inserted {stats["rows_inserted"]} '
+                f'{stats["table"]} records, {stats["rows_skipped"]} skipped'
+            )
+        )
+        return stats
+
+    def verify(self, result):
+        # only the imported ids are checked, rows from elsewhere are not
+        style = self.style.SUCCESS if result['ok'] else self.style.ERROR
+        self.stdout.write(
+            style(
+                f'Verified {result["table"]}: {result["source_rows"]} rows '
+                f'in SQLite, {result["target_rows"]} found in Postgres, '
+                f'{result["differ"]} differ'
+            )
+        )
+        for kind in ('missing', 'differ'):
+            if result[kind]:
+                self.stdout.write(self.style.ERROR(
+                    f'  {kind}: ' + ', '.join(result[f'{kind}_ids']) +
+                    (', ...' if result[kind] > len(result[f'{kind}_ids'])
+                     else '')))
+        return result
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_constraint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filmwork',
+            index=models.Index(fields=['updated_at', 'id'], name='film_work_updated_at_idx'),
+        ),
+    ]
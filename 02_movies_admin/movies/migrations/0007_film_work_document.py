@@ -0,0 +1,26 @@
+# Generated by Django 4.0.4 on 2026-10-18 12:53
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_film_work_updated_at_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilmworkDocument',
+            fields=[
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('film_work', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='movies.filmwork')),
+                ('document', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='document')),
+            ],
+            options={
+                'db_table': 'content"."film_work_document',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.4 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_api_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filmworkdocument',
+            index=models.Index(fields=['updated_at'], name='film_work_document_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='genre',
+            index=models.Index(fields=['updated_at'], name='genre_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='genrefilmwork',
+            index=models.Index(fields=['created_at'], name='genre_film_work_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['updated_at'], name='person_updated_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='personfilmwork',
+            index=models.Index(fields=['created_at'], name='person_film_work_created_idx'),
+        ),
+    ]
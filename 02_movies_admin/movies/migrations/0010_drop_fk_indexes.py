@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+# 0008 turned db_index off on these keys, but django does not find indexes
+# of the "content"."..." tables to drop them; the composite
+# (genre_id, film_work_id) and (person_id, film_work_id) ones serve instead
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0009_export_change_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='DROP INDEX IF EXISTS content.genre_film_work_genre_id_88fbcf0d;',
+            reverse_sql='CREATE INDEX IF NOT EXISTS genre_film_work_genre_id_88fbcf0d '
+                        'ON content.genre_film_work (genre_id);',
+        ),
+        migrations.RunSQL(
+            sql='DROP INDEX IF EXISTS content.person_film_work_person_id_196d24de;',
+            reverse_sql='CREATE INDEX IF NOT EXISTS person_film_work_person_id_196d24de '
+                        'ON content.person_film_work (person_id);',
+        ),
+    ]
@@ -1,5 +1,6 @@
 
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.translation import gettext_lazy as _
 
@@ -55,6 +56,11 @@ class Person(UUIDMixin, CreatedAtMixin, UpdatedAtMixin):
     class Meta:
         # Ваши таблицы находятся в нестандартной схеме.
         db_table = "content\".\"person"
+        # Поиск изменений для выгрузки в поиск
+        indexes = [
+            models.Index(fields=['updated_at'],
+                         name='person_updated_at_idx'),
+        ]
         # Следующие два поля отвечают за название модели в интерфейсе
         verbose_name = 'Персона'
         verbose_name_plural = 'Персоны'
@@ -73,6 +79,11 @@ class Genre(UUIDMixin, CreatedAtMixin, UpdatedAtMixin):
     class Meta:
         # Ваши таблицы находятся в нестандартной схеме.
         db_table = "content\".\"genre"
+        # Поиск изменений для выгрузки в поиск
+        indexes = [
+            models.Index(fields=['updated_at'],
+                         name='genre_updated_at_idx'),
+        ]
         # Следующие два поля отвечают за название модели в интерфейсе
         verbose_name = 'Жанр'
         verbose_name_plural = 'Жанры'
@@ -109,6 +120,20 @@ class Filmwork(UUIDMixin, CreatedAtMixin, UpdatedAtMixin):
     class Meta:
         # Ваши таблицы находятся в нестандартной схеме.
         db_table = "content\".\"film_work"
+        # Ключи фильтров и сортировок API, id завершает каждый ключ
+        # для стабильного порядка страниц
+        indexes = [
+            models.Index(fields=['updated_at', 'id'],
+                         name='film_work_updated_at_idx'),
+            models.Index(fields=['creation_date', 'id'],
+                         name='film_work_creation_date_idx'),
+            models.Index(fields=['rating', 'id'],
+                         name='film_work_rating_idx'),
+            models.Index(fields=['title', 'id'],
+                         name='film_work_title_idx'),
+            models.Index(fields=['type', 'id'],
+                         name='film_work_type_idx'),
+        ]
         # Следующие два поля отвечают за название модели в интерфейсе
         verbose_name = 'Кинопроизведение'
         verbose_name_plural = 'Кинопроизведения'
@@ -124,10 +149,20 @@ class GenreFilmwork(UUIDMixin, CreatedAtMixin):
         return self.genre.name
 
     film_work = models.ForeignKey('Filmwork', on_delete=models.CASCADE)
-    genre = models.ForeignKey('Genre', on_delete=models.CASCADE)
+    # индекс по жанру покрыт составным индексом ниже
+    genre = models.ForeignKey('Genre', on_delete=models.CASCADE,
+                              db_index=False)
 
     class Meta:
         db_table = "content\".\"genre_film_work"
+        # Фильмы жанра для фильтра API, без обращения к самой таблице
+        indexes = [
+            models.Index(fields=['genre', 'film_work'],
+                         name='genre_film_work_genre_idx'),
+            # новые связи для выгрузки в поиск
+            models.Index(fields=['created_at'],
+                         name='genre_film_work_created_idx'),
+        ]
 
         # Put UNIQUE constraint - a set of columns must be unique in each row
         unique_together = ('film_work', 'genre',)
@@ -139,12 +174,43 @@ class PersonFilmwork(UUIDMixin, CreatedAtMixin):
         return self.person.full_name + ' - ' + self.role
 
     film_work = models.ForeignKey('filmwork', on_delete=models.CASCADE)
-    person = models.ForeignKey('person', on_delete=models.CASCADE)
+    # индекс по персоне покрыт составным индексом ниже
+    person = models.ForeignKey('person', on_delete=models.CASCADE,
+                               db_index=False)
 
     role = models.CharField(_('role'), max_length=255, null=True)
 
     class Meta:
         db_table = "content\".\"person_film_work"
+        # Фильмы персоны для фильтра API, без обращения к самой таблице
+        indexes = [
+            models.Index(fields=['person', 'film_work'],
+                         name='person_film_work_person_idx'),
+            # новые связи для выгрузки в поиск
+            models.Index(fields=['created_at'],
+                         name='person_film_work_created_idx'),
+        ]
 
         # Put UNIQUE constraint - a set of columns must be unique in each row
         unique_together = ('film_work', 'person', 'role',)
+
+
+#
+# Денормализованные модели для чтения
+#
+
+class FilmworkDocument(UpdatedAtMixin):
+    # Готовый к отдаче документ API: фильм вместе с персонами и жанрами.
+    # Пересобирается при каждом изменении фильма или его связей
+    film_work = models.OneToOneField('Filmwork', primary_key=True,
+                                     on_delete=models.CASCADE,
+                                     related_name='document')
+    document = models.JSONField(_('document'), encoder=DjangoJSONEncoder)
+
+    class Meta:
+        db_table = "content\".\"film_work_document"
+        # Пересобранные документы для выгрузки в поиск
+        indexes = [
+            models.Index(fields=['updated_at'],
+                         name='film_work_document_updated_idx'),
+        ]
@@ -1,11 +1,68 @@
+from django.dispatch import receiver
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 
-import datetime
+from movies.api.v1.cache import evict_films
+from movies.documents import build_documents
+from movies.models import Filmwork, Genre, Person
+from movies.models import GenreFilmwork, PersonFilmwork
+
+
+# Поддержка денормализованных документов фильмов и кэша API
+# в актуальном состоянии
+class ChangedFilms(set):
+    '''
+    Films changed on a connection, refreshed together at the next commit.
+    Every change queues a call, the first one to run takes all the films,
+    the rest find nothing left; a call dropped with a rolled back savepoint
+    leaves its films to the calls queued after it.
+    '''
+    def __call__(self):
+        if not self:
+            return
+        ids = set(self)
+        self.clear()
+        build_documents(ids)
+        evict_films(ids)
+
+
+def films_changed(ids):
+    # an admin save of a film with its inlines sends a signal per row,
+    # ids are collected on the connection to rebuild each document once
+    ids = set(ids)
+    if not ids:
+        return
+    connection = transaction.get_connection()
+    if not hasattr(connection, 'changed_films'):
+        connection.changed_films = ChangedFilms()
+    connection.changed_films.update(ids)
+    transaction.on_commit(connection.changed_films)
+
+
+@receiver(post_save, sender=Filmwork)
+@receiver(post_delete, sender=Filmwork)
+def film_work_changed(sender, instance, **kwargs):
+    films_changed([instance.id])
+
+
+@receiver(post_save, sender=Person)
+def person_changed(sender, instance, created, **kwargs):
+    if not created:
+        films_changed(PersonFilmwork.objects.filter(
+            person_id=instance.id).values_list('film_work_id', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+def genre_changed(sender, instance, created, **kwargs):
+    if not created:
+        films_changed(GenreFilmwork.objects.filter(
+            genre_id=instance.id).values_list('film_work_id', flat=True))
 
-from django.dispatch import receiver
-from django.db.models.signals import post_save
 
-# pre_save / post_save помогают создать обработчики добавления моделей в базу
-@receiver(post_save, sender='movies.Person')
-def congratulatory(sender, instance, created, **kwargs):
-    if created and instance.birth_date == datetime.date.today():
-        print(f"У {instance.full_name} сегодня день рождения! 🥳")
\ No newline at end of file
+# удаление персон и жанров каскадом удаляет связи, что вызывает пересборку
+@receiver(post_save, sender=PersonFilmwork)
+@receiver(post_save, sender=GenreFilmwork)
+@receiver(post_delete, sender=PersonFilmwork)
+@receiver(post_delete, sender=GenreFilmwork)
+def relation_changed(sender, instance, **kwargs):
+    films_changed([instance.film_work_id])
@@ -0,0 +1,87 @@
+from django.core.cache import cache
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase
+
+from movies.api.v1.cache import evict_films, film_key
+from movies.api.v1.cache import get_response, page_key, set_response
+from movies.factories import FilmworkFactory
+from movies.models import Filmwork
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_variants_share_the_key(self):
+        set_response('movies:film:1', b'full', etag='"a"')
+        set_response('movies:film:1', b'sparse', 'id,title', '"b"')
+        self.assertEqual(get_response('movies:film:1'), ('"a"', b'full'))
+        self.assertEqual(get_response('movies:film:1', 'id,title'),
+                         ('"b"', b'sparse'))
+        self.assertIsNone(get_response('movies:film:1', 'id')[1])
+
+    def test_body_of_another_etag_is_not_served(self):
+        set_response('movies:film:1', b'full', etag='"a"')
+        self.assertEqual(get_response('movies:film:1', etag='"a"')[1],
+                         b'full')
+        self.assertIsNone(get_response('movies:film:1', etag='"b"')[1])
+
+    def test_eviction_waits_for_commit(self):
+        set_response(film_key(1), b'film')
+        key = page_key(QueryDict())
+        with self.captureOnCommitCallbacks() as callbacks:
+            evict_films([1])
+        self.assertEqual(get_response(film_key(1))[1], b'film')
+
+        callbacks[0]()
+        self.assertIsNone(get_response(film_key(1))[1])
+        self.assertNotEqual(page_key(QueryDict()), key)
+
+    def test_page_key_ignores_params_order(self):
+        self.assertEqual(page_key(QueryDict('sort=title&genre=x')),
+                         page_key(QueryDict('genre=x&sort=title')))
+        self.assertNotEqual(page_key(QueryDict('sort=title')),
+                            page_key(QueryDict('sort=-title')))
+
+
+class CachedApiTest(TransactionTestCase):
+    'saves are committed for real, to run on_commit eviction'
+
+    def setUp(self):
+        cache.clear()
+        self.film = FilmworkFactory(title='Before')
+
+    def tearDown(self):
+        # flush does not reach tables of the content schema
+        Filmwork.objects.all().delete()
+
+    def test_detail_is_evicted_on_save(self):
+        url = f'/api/v1/movies/{self.film.id}/'
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.film.title = 'After'
+        self.film.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['title'], 'After')
+
+    def test_list_hit_runs_no_queries(self):
+        etag = self.client.get('/api/v1/movies/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/v1/movies/')
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertEqual(response['ETag'], etag)
+            response = self.client.get(
+                '/api/v1/movies/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_list_pages_are_evicted_on_save(self):
+        self.assertEqual(self.client.get('/api/v1/movies/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/api/v1/movies/')['X-Cache'], 'HIT')
+
+        FilmworkFactory(title='New')
+        response = self.client.get('/api/v1/movies/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 2)
@@ -0,0 +1,51 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from movies.documents import build_documents
+from movies.factories import FilmworkFactory
+from movies.models import Filmwork
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.film = FilmworkFactory(title='Before')
+        build_documents([cls.film.id])
+
+    def setUp(self):
+        cache.clear()
+        self.url = f'/api/v1/movies/{self.film.id}/'
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_is_validated_by_etag_only(self):
+        response = self.client.get('/api/v1/movies/')
+        self.assertNotIn('Last-Modified', response)
+
+        response = self.client.get(
+            '/api/v1/movies/',
+            HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/api/v1/movies/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_stale_body_is_not_served_under_a_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+
+        # rebuilt by another process, nothing evicted here
+        Filmwork.objects.filter(pk=self.film.id).update(title='After')
+        build_documents([self.film.id])
+
+        response = self.client.get(self.url)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['title'], 'After')
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
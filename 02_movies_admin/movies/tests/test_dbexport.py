@@ -0,0 +1,198 @@
+import tempfile
+from collections import namedtuple
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import psycopg2
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from movies.factories import FilmworkFactory, GenreFactory, PersonFactory
+from movies.management.commands import dbexport
+from movies.models import Filmwork, GenreFilmwork, PersonFilmwork
+
+
+class StopDaemon(Exception):
+    pass
+
+
+class DaemonLoopTest(SimpleTestCase):
+    'cycles of dbexport with connections and the cycle itself mocked'
+
+    def setUp(self):
+        for name in ('PostgresConnection', 'DocumentHashes'):
+            patcher = mock.patch.object(dbexport.db, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(dbexport.elastic, 'EsManager')
+        self.EsManager = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_export(self, results, *args, cycles=None):
+        'run cycles with the given results, exceptions are raised'
+        etl = mock.patch.object(
+            dbexport.Command, '_etl_process', side_effect=results)
+        # the daemon is stopped by its sleep after the given cycles
+        cycles = cycles or len(results)
+        sleep = mock.patch.object(
+            dbexport, 'sleep', side_effect=[None] * (cycles - 1) + [StopDaemon])
+        with etl as etl_process, sleep:
+            try:
+                call_command('dbexport', *args, stdout=StringIO())
+            except StopDaemon:
+                pass
+        # startdate and full_reindex of every cycle
+        return [(call.args[3], call.args[5])
+                for call in etl_process.call_args_list]
+
+    def test_overrides_kept_until_cycle_succeeds(self):
+        cycles = self.run_export(
+            [False, psycopg2.OperationalError('gone'), True, True],
+            '-d', '--interval', '0', '--full-reindex',
+            '--exportafter', '2021-01-01')
+        self.assertEqual(
+            [(startdate is not None, full) for startdate, full in cycles],
+            [(True, True)] * 3 + [(False, False)])
+
+    def test_connection_failure_reopens_connections(self):
+        self.run_export(
+            [psycopg2.OperationalError('gone'), True],
+            '-d', '--interval', '0')
+        self.PostgresConnection.return_value.close.assert_called()
+        self.DocumentHashes.return_value.rollback.assert_called_once()
+        self.assertEqual(self.EsManager.call_count, 2)
+
+    def test_elastic_down_skips_cycle(self):
+        self.EsManager.return_value.check.side_effect = [
+            dbexport.elastic.ElasticUnavailable('down'), None]
+        cycles = self.run_export([True], '-d', '--interval', '0', cycles=2)
+        self.assertEqual(len(cycles), 1)
+
+    def test_bulk_sizing_options(self):
+        self.run_export([True], '--chunk-size', '100',
+                        '--chunk-bytes', '1024', '--threads', '2')
+        self.EsManager.assert_called_once_with(
+            'movies', chunk_size=100, threads=2, chunk_bytes=1024)
+
+    def test_one_off_failure_exits_non_zero(self):
+        with self.assertRaises(CommandError):
+            self.run_export([False])
+
+    def test_one_off_connection_failure_raises(self):
+        with self.assertRaises(psycopg2.OperationalError):
+            self.run_export([psycopg2.OperationalError('gone')])
+
+
+class DocumentHashesTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.hashes = dbexport.db.DocumentHashes(tmp.name)
+        self.addCleanup(self.hashes.close)
+        self.docs = [{'id': str(i), 'title': f'film {i}'} for i in range(3)]
+
+    def changed(self, docs, **kwargs):
+        return [doc['id'] for doc in self.hashes.changed(docs, **kwargs)]
+
+    def test_skips_committed_unchanged_docs(self):
+        self.assertEqual(self.changed(self.docs), ['0', '1', '2'])
+        self.assertEqual((self.hashes.written, self.hashes.skipped), (3, 0))
+        self.hashes.commit()
+        self.assertEqual((self.hashes.written, self.hashes.skipped), (0, 0))
+
+        docs = self.docs + [{'id': '3', 'title': 'film 3'}]
+        docs[0] = {**docs[0], 'title': 'renamed'}
+        self.assertEqual(self.changed(docs), ['0', '3'])
+        self.assertEqual((self.hashes.written, self.hashes.skipped), (2, 2))
+
+    def test_key_order_does_not_matter(self):
+        self.changed(self.docs)
+        self.hashes.commit()
+        reordered = [dict(reversed(doc.items())) for doc in self.docs]
+        self.assertEqual(self.changed(reordered), [])
+
+    def test_rollback_forgets_hashes(self):
+        self.changed(self.docs)
+        self.hashes.rollback()
+        self.assertEqual((self.hashes.written, self.hashes.skipped), (0, 0))
+        self.assertEqual(self.changed(self.docs), ['0', '1', '2'])
+
+    def test_force_passes_unchanged_docs(self):
+        self.changed(self.docs)
+        self.hashes.commit()
+        self.assertEqual(self.changed(self.docs, force=True), ['0', '1', '2'])
+        self.assertEqual(self.hashes.skipped, 0)
+
+
+class ChangeDetectorTest(TestCase):
+    'detector and enricher read the test transaction through its connection'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.film, cls.other = FilmworkFactory.create_batch(2)
+        cls.person = PersonFactory()
+        PersonFilmwork.objects.create(
+            film_work=cls.film, person=cls.person, role='actor')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state = dbexport.db.ETLState(tmp.name)
+        connection.ensure_connection()
+        self.psg = connection.connection
+
+    def cycle(self, **kwargs):
+        'ids of films produced by a cycle, its watermarks are committed'
+        kwargs.setdefault('lag', timedelta(0))
+        producer = dbexport.db.PostgresChangeDetector(
+            self.psg, state=self.state, **kwargs)
+        ids = {str(row.id) for row in producer.produce()}
+        producer.commit()
+        return ids
+
+    def test_changes_are_produced_once(self):
+        self.assertEqual(self.cycle(), {str(self.film.id), str(self.other.id)})
+        self.assertEqual(self.cycle(), set())
+
+    def test_person_edit_produces_their_films(self):
+        self.cycle()
+        self.person.full_name = 'Renamed'
+        self.person.save()
+        self.assertEqual(self.cycle(), {str(self.film.id)})
+
+    def test_recent_changes_wait_for_the_lag(self):
+        self.assertEqual(self.cycle(lag=timedelta(hours=1)), set())
+        # as if committed late, stamped before the previous cycle
+        Filmwork.objects.filter(pk=self.film.id).update(
+            updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.cycle(lag=timedelta(hours=1)),
+                         {str(self.film.id)})
+
+    def test_enricher_builds_documents(self):
+        writer, director = PersonFactory.create_batch(2)
+        PersonFilmwork.objects.create(
+            film_work=self.film, person=writer, role='writer')
+        PersonFilmwork.objects.create(
+            film_work=self.film, person=director, role='director')
+        genres = GenreFactory.create_batch(2)
+        for genre in genres:
+            GenreFilmwork.objects.create(film_work=self.film, genre=genre)
+
+        enricher = dbexport.db.PostgresEnricher('film_work', self.psg)
+        Row = namedtuple('Row', 'id')
+        [documents] = enricher.stream([Row(self.film.id)])
+
+        self.assertEqual(len(documents), 1)
+        document = documents[0]
+        self.assertEqual(document['title'], self.film.title)
+        self.assertEqual(document['director'], director.full_name)
+        self.assertEqual(document['actors'], [
+            {'id': str(self.person.id), 'name': self.person.full_name}])
+        self.assertEqual(document['writers_names'], writer.full_name + ',')
+        self.assertEqual(document['genre'],
+                         sorted(genre.name for genre in genres))
@@ -0,0 +1,212 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import uuid
+from dataclasses import fields
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from movies.factories import FilmworkFactory
+from movies.models import Filmwork
+
+sys.path.append('../03_sqlite_to_postgres')
+import db  # noqa: E402
+from dataclass import UNKNOWN_DATE, FilmWork, Person  # noqa: E402
+from dataclass import row_converter  # noqa: E402
+
+NOW = '2021-06-16 20:14:09.221838+00'
+
+
+class ImportTestCase(TransactionTestCase):
+    'import_table commits on connections of its own, to the test db'
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        environ = mock.patch.dict(os.environ, {
+            'POSTGRES_DB': connection.settings_dict['NAME'],
+            'DJANGO_DATA_DIR': self.tmp.name,
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.dbfile = os.path.join(self.tmp.name, 'db.sqlite')
+
+    def tearDown(self):
+        # flush does not reach tables of the content schema
+        Filmwork.objects.all().delete()
+
+    def populate_sqlite(self, films, nulls=False):
+        conn = sqlite3.connect(self.dbfile)
+        conn.execute('''
+            CREATE TABLE film_work (id TEXT PRIMARY KEY, title TEXT,
+                description TEXT, creation_date DATE, file_path TEXT,
+                rating FLOAT, type TEXT, created_at TIMESTAMP,
+                updated_at TIMESTAMP);''')
+        conn.executemany(
+            'INSERT INTO film_work VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                (str(uuid.uuid4()), f'film {i}', *(
+                    (None, None, None, None) if nulls else
+                    ('about', '2000-01-01', None, 5.0)), 'movie', NOW, NOW)
+                for i in range(films)))
+        conn.commit()
+        conn.close()
+
+
+class ImportCheckpointTest(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.populate_sqlite(1)
+
+    def test_offset_is_kept_between_runs(self):
+        db.ImportCheckpoint(self.dbfile, 'film_work').advance(10)
+        checkpoint = db.ImportCheckpoint(self.dbfile, 'film_work')
+        self.assertEqual(checkpoint.offset, 10)
+
+        checkpoint.clear()
+        self.assertEqual(
+            db.ImportCheckpoint(self.dbfile, 'film_work').offset, 0)
+
+    def test_checkpoint_of_another_db_is_ignored(self):
+        db.ImportCheckpoint(self.dbfile, 'film_work').advance(10)
+        with sqlite3.connect(self.dbfile) as conn:
+            conn.execute('DELETE FROM film_work;')
+        self.assertEqual(
+            db.ImportCheckpoint(self.dbfile, 'film_work').offset, 0)
+
+
+class ImportResumeTest(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.populate_sqlite(25)
+
+    def fail_after(self, rows):
+        fetch_table = db.SQLiteLoader.fetch_table
+
+        def failing(loader, *args, **kwargs):
+            for i, row in enumerate(fetch_table(loader, *args, **kwargs)):
+                if i == rows:
+                    raise RuntimeError('connection lost')
+                yield row
+        return mock.patch.object(db.SQLiteLoader, 'fetch_table', failing)
+
+    def test_resume_after_failure(self):
+        for method in ('copy_table', 'insert_table'):
+            with self.subTest(method):
+                with self.fail_after(15), self.assertRaises(RuntimeError):
+                    db.import_table(self.dbfile, 'film_work', FilmWork,
+                                    method, chunk_size=10)
+                self.assertEqual(Filmwork.objects.count(), 10)
+
+                stats = db.import_table(self.dbfile, 'film_work', FilmWork,
+                                        method, chunk_size=10)
+                self.assertEqual(stats['rows_read'], 15)
+                self.assertEqual(stats['rows_inserted'], 15)
+                self.assertEqual(Filmwork.objects.count(), 25)
+                self.assertEqual(
+                    db.ImportCheckpoint(self.dbfile, 'film_work').offset, 25)
+
+                db.ImportCheckpoint(self.dbfile, 'film_work').clear()
+                Filmwork.objects.all().delete()
+
+    def test_rows_committed_before_a_crash_are_skipped(self):
+        # committed, but killed before the checkpoint was written
+        with mock.patch.object(db.ImportCheckpoint, 'advance'):
+            db.import_table(self.dbfile, 'film_work', FilmWork,
+                            chunk_size=10)
+
+        stats = db.import_table(self.dbfile, 'film_work', FilmWork,
+                                chunk_size=10)
+        self.assertEqual(stats['rows_read'], 25)
+        self.assertEqual(stats['rows_inserted'], 0)
+        self.assertEqual(Filmwork.objects.count(), 25)
+
+    def test_restart_ignores_the_checkpoint(self):
+        db.ImportCheckpoint(self.dbfile, 'film_work').advance(20)
+        stats = db.import_table(self.dbfile, 'film_work', FilmWork,
+                                chunk_size=10, resume=False)
+        self.assertEqual(stats['rows_read'], 25)
+        self.assertEqual(Filmwork.objects.count(), 25)
+
+
+class RowConverterTest(SimpleTestCase):
+    film_columns = ('id', 'title', 'description', 'creation_date',
+                    'file_path', 'rating', 'type', 'created_at', 'updated_at')
+
+    def convert_film(self, created_at, fill):
+        convert = row_converter(FilmWork, self.film_columns, fill)
+        row = (str(uuid.uuid4()), 'film', None, None, None, None, 'movie',
+               created_at, NOW)
+        return dict(zip([field.name for field in fields(FilmWork)],
+                        convert(row)))
+
+    def test_creation_date_without_filler(self):
+        self.assertEqual(
+            self.convert_film(NOW, fill=False)['creation_date'], NOW[:10])
+        self.assertEqual(
+            self.convert_film(None, fill=False)['creation_date'],
+            UNKNOWN_DATE)
+
+    def test_person_gender_is_left_null_without_filler(self):
+        columns = ('id', 'full_name', 'created_at', 'updated_at')
+        row = (str(uuid.uuid4()), 'name', NOW, NOW)
+        gender = [field.name for field in fields(Person)].index('gender')
+        self.assertIsNone(row_converter(Person, columns, False)(row)[gender])
+        self.assertIn(row_converter(Person, columns)(row)[gender],
+                      ('male', 'female'))
+
+
+class ImportNullsTest(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.populate_sqlite(3, nulls=True)
+
+    def test_not_null_columns_are_fixed_without_filler(self):
+        db.import_table(self.dbfile, 'film_work', FilmWork, fill=False)
+        self.assertEqual(Filmwork.objects.count(), 3)
+        for film in Filmwork.objects.all():
+            self.assertEqual(film.description, '')
+            self.assertEqual(film.rating, 0.0)
+            self.assertEqual(str(film.creation_date), NOW[:10])
+            self.assertFalse(film.file_path)
+
+    def test_filler_fills_every_column(self):
+        db.import_table(self.dbfile, 'film_work', FilmWork)
+        for film in Filmwork.objects.all():
+            self.assertTrue(film.description)
+            self.assertTrue(film.file_path)
+
+
+class VerifyTableTest(ImportTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.populate_sqlite(3)
+        db.import_table(self.dbfile, 'film_work', FilmWork)
+
+    def verify(self):
+        return db.verify_table(self.dbfile, 'film_work', FilmWork)
+
+    def test_rows_of_other_sources_do_not_count(self):
+        FilmworkFactory.create_batch(2)
+        result = self.verify()
+        self.assertTrue(result['ok'])
+        self.assertEqual((result['source_rows'], result['target_rows']),
+                         (3, 3))
+
+    def test_missing_and_differing_rows_are_named(self):
+        lost, changed, _ = Filmwork.objects.order_by('id')
+        lost_id = str(lost.id)
+        lost.delete()
+        Filmwork.objects.filter(id=changed.id).update(title='changed')
+
+        result = self.verify()
+        self.assertFalse(result['ok'])
+        self.assertEqual((result['missing'], result['differ']), (1, 1))
+        self.assertEqual(result['missing_ids'], [lost_id])
+        self.assertEqual(result['differ_ids'], [str(changed.id)])
@@ -0,0 +1,50 @@
+import json
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from movies.documents import build_documents
+from movies.factories import FilmworkFactory
+from movies.models import Filmwork, FilmworkDocument
+
+
+class ExportApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.films = FilmworkFactory.create_batch(3)
+        build_documents([film.id for film in cls.films])
+        # the first film and its document were last changed long ago
+        old = timezone.now() - timedelta(days=30)
+        Filmwork.objects.filter(pk=cls.films[0].id).update(updated_at=old)
+        FilmworkDocument.objects.filter(
+            pk=cls.films[0].id).update(updated_at=old)
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/movies/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_one_document_per_line(self):
+        films = self.export()
+        self.assertEqual([film['id'] for film in films],
+                         sorted(str(film.id) for film in self.films))
+        self.assertEqual(films[0]['title'], Filmwork.objects.order_by(
+            'id').first().title)
+
+    def test_updated_since(self):
+        since = (timezone.now() - timedelta(days=1)).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
+        films = self.export(updated_since=since)
+        self.assertEqual({film['id'] for film in films},
+                         {str(film.id) for film in self.films[1:]})
+
+    def test_bad_updated_since(self):
+        for value in ('yesterday', '2021-13-01T00:00:00'):
+            with self.subTest(value):
+                response = self.client.get(
+                    '/api/v1/movies/export/', {'updated_since': value})
+                self.assertEqual(response.status_code, 400)
@@ -0,0 +1,151 @@
+import json
+from base64 import urlsafe_b64encode
+
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.paginator import EmptyPage
+from django.test import TestCase
+
+from movies.api.v1.pagination import CursorPaginator, InvalidCursor
+from movies.api.v1.pagination import EstimatedCountPaginator
+from movies.api.v1.views import MoviesListApi
+from movies.factories import FilmworkFactory
+from movies.models import Filmwork
+
+
+def forge_cursor(payload):
+    data = json.dumps(payload).encode()
+    return urlsafe_b64encode(data).decode().rstrip('=')
+
+
+class CursorPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        FilmworkFactory.create_batch(7)
+
+    def setUp(self):
+        self.paginator = CursorPaginator(Filmwork.objects.all(), 3)
+
+    def test_pages_through_every_film_once(self):
+        ids, cursor = [], None
+        while True:
+            page = self.paginator.page(cursor)
+            ids.extend(page.object_list)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(set(ids),
+                         set(Filmwork.objects.values_list('id', flat=True)))
+
+    def test_descending_ordering(self):
+        paginator = CursorPaginator(
+            Filmwork.objects.all(), 3, ordering=('-rating', '-id'))
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        expected = list(Filmwork.objects.order_by(
+            '-rating', '-id').values_list('id', flat=True))
+        self.assertEqual(first.object_list + second.object_list,
+                         expected[:6])
+
+    def test_cursor_roundtrip(self):
+        film = Filmwork.objects.first()
+        cursor = self.paginator.encode_cursor((film.updated_at, film.id))
+        self.assertEqual(self.paginator.decode_cursor(cursor),
+                         [film.updated_at, film.id])
+
+    def test_rejects_malformed_cursors(self):
+        film = Filmwork.objects.first()
+        cursors = {
+            'not base64': '!!!',
+            'not json': urlsafe_b64encode(b'{[').decode(),
+            'other ordering': forge_cursor(
+                [['-rating', '-id'], [1.0, str(film.id)]]),
+            'wrong arity': forge_cursor(
+                [['updated_at', 'id'], [str(film.updated_at)]]),
+            'bad value': forge_cursor(
+                [['updated_at', 'id'], [str(film.updated_at), 'nope']]),
+            'not a list': forge_cursor('cursor'),
+        }
+        for label, cursor in cursors.items():
+            with self.subTest(label), self.assertRaises(InvalidCursor):
+                self.paginator.decode_cursor(cursor)
+
+
+class CursorListApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        FilmworkFactory.create_batch(3)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_page_and_next_cursor(self):
+        data = self.client.get('/api/v1/movies/?cursor=').json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_malformed_cursor_is_bad_request(self):
+        response = self.client.get('/api/v1/movies/?cursor=garbage')
+        self.assertEqual(response.status_code, 400)
+
+
+@mock.patch.object(EstimatedCountPaginator, 'exact_count_threshold', 1)
+class EstimatedCountPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        FilmworkFactory.create_batch(7)
+
+    def paginator(self, estimate):
+        queryset = Filmwork.objects.all()
+        with mock.patch('movies.api.v1.pagination.estimate_count',
+                        return_value=estimate):
+            paginator = EstimatedCountPaginator(
+                queryset.order_by('id'), 3, count_queryset=queryset)
+            paginator.count
+        return paginator
+
+    def walk(self, paginator):
+        ids, number = [], 1
+        while True:
+            page = paginator.page(number)
+            ids.extend(page.object_list)
+            if not page.has_next():
+                return ids, page
+            number = page.next_page_number()
+
+    def test_estimate_below_real_count(self):
+        paginator = self.paginator(4)
+        self.assertEqual(paginator.count, 4)
+        ids, last = self.walk(paginator)
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(last.number, 3)
+        self.assertEqual(paginator.num_pages, 3)
+
+    def test_estimate_above_real_count(self):
+        paginator = self.paginator(30)
+        ids, last = self.walk(paginator)
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(last.number, 3)
+        self.assertEqual(paginator.num_pages, 3)
+        with self.assertRaises(EmptyPage):
+            paginator.page(4)
+
+    def test_list_api_reaches_films_past_estimate(self):
+        cache.clear()
+        with mock.patch('movies.api.v1.pagination.estimate_count',
+                        return_value=4), \
+                mock.patch.object(MoviesListApi, 'paginate_by', 3):
+            page = self.client.get('/api/v1/movies/?page=2').json()
+            self.assertEqual(page['count'], 4)
+            self.assertEqual(page['next'], 3)
+            last = self.client.get('/api/v1/movies/?page=3').json()
+            self.assertEqual(len(last['results']), 1)
+            self.assertIsNone(last['next'])
+            self.assertEqual(last['total_pages'], 3)
+            response = self.client.get('/api/v1/movies/?page=4')
+            self.assertEqual(response.status_code, 404)
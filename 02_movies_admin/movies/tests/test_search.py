@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from movies.api.v1.search import close_client, encode_cursor
+
+
+class StandInElastic(BaseHTTPRequestHandler):
+    'answers search requests with pages of hits, keeping request bodies'
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def reply(self, status, body):
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.requests.append(('GET', self.path, None))
+        self.reply(200, {'version': {'number': '7.17.0',
+                                     'build_flavor': 'default'},
+                         'tagline': 'You Know, for Search'})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append(('POST', self.path, body))
+        if self.path.startswith('/broken/'):
+            return self.reply(500, {'error': {
+                'type': 'search_phase_execution_exception'}, 'status': 500})
+        if not self.path.startswith('/movies/'):
+            return self.reply(404, {'error': {
+                'type': 'index_not_found_exception'}, 'status': 404})
+        # sort values must match the sort field types
+        if not all(isinstance(value, (int, float))
+                   for value in body.get('search_after', [0])[:1]):
+            return self.reply(400, {'error': {
+                'type': 'search_phase_execution_exception'}, 'status': 400})
+        self.reply(200, {'took': 1, 'timed_out': False, 'hits': {
+            'total': {'value': 3, 'relation': 'eq'},
+            'hits': [{
+                '_id': str(i), '_score': 1.0,
+                '_source': {'id': str(i), 'title': f'film {i}'},
+                'sort': [1.0, str(i)],
+            } for i in range(body['size'])]}})
+
+    def log_message(self, *args):
+        pass
+
+
+class SearchApiTest(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInElastic)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        StandInElastic.requests.clear()
+        environ = mock.patch.dict(os.environ, {
+            'ELASTIC_HOST': '127.0.0.1',
+            'ELASTIC_PORT': str(self.server.server_port),
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.addCleanup(close_client)
+
+    def searches(self):
+        return [body for method, path, body in StandInElastic.requests
+                if method == 'POST']
+
+    def test_full_text_query_with_filters(self):
+        response = self.client.get('/api/v1/search/', {
+            'query': 'star', 'genre': 'Sci-Fi', 'rating_min': 7,
+            'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([film['id'] for film in data['results']],
+                         ['0', '1'])
+        self.assertIsNotNone(data['next_cursor'])
+
+        body = self.searches()[0]
+        self.assertEqual(body['size'], 2)
+        self.assertEqual(body['query']['bool']['must']['multi_match'], {
+            'query': 'star', 'fields': ['title^3', 'description'],
+            'analyzer': 'ru_en'})
+        self.assertEqual(body['query']['bool']['filter'], [
+            {'term': {'genre': 'Sci-Fi'}},
+            {'range': {'imdb_rating': {'gte': 7.0}}}])
+
+    def test_next_page_searches_after_the_last_hit(self):
+        first = self.client.get(
+            '/api/v1/search/', {'query': 'star', 'page_size': 2}).json()
+        self.client.get('/api/v1/search/', {
+            'query': 'star', 'page_size': 2, 'cursor': first['next_cursor']})
+        self.assertEqual(self.searches()[1]['search_after'], [1.0, '1'])
+
+    def test_results_are_cached(self):
+        params = {'query': 'star'}
+        self.assertEqual(
+            self.client.get('/api/v1/search/', params)['X-Cache'], 'MISS')
+        self.assertEqual(
+            self.client.get('/api/v1/search/', params)['X-Cache'], 'HIT')
+        self.assertEqual(len(self.searches()), 1)
+
+    def test_client_is_shared_by_requests(self):
+        for query in ('one', 'two', 'three'):
+            self.client.get('/api/v1/search/', {'query': query})
+        product_checks = [path for method, path, body
+                          in StandInElastic.requests if method == 'GET']
+        self.assertEqual(len(product_checks), 1)
+        self.assertEqual(len(self.searches()), 3)
+
+    def test_bad_params(self):
+        for params in ({'page_size': 500}, {'rating_min': 'high'},
+                       {'cursor': 'garbage'}):
+            with self.subTest(params):
+                response = self.client.get('/api/v1/search/', params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_cursor_of_another_sort(self):
+        cursor = self.client.get(
+            '/api/v1/search/', {'page_size': 2}).json()['next_cursor']
+        response = self.client.get(
+            '/api/v1/search/', {'query': 'star', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_of_wrong_types(self):
+        cursor = encode_cursor(
+            [{'_score': 'desc'}, {'id': 'asc'}], ['high', '1'])
+        response = self.client.get(
+            '/api/v1/search/', {'query': 'star', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.searches()), 1)
+
+    def test_only_get_is_allowed(self):
+        self.assertEqual(
+            self.client.post('/api/v1/search/').status_code, 405)
+
+    def test_missing_index_is_unavailable(self):
+        with mock.patch('movies.api.v1.search.SEARCH_INDEX', 'missing'):
+            response = self.client.get('/api/v1/search/', {'query': 'x'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_elastic_error_is_unavailable(self):
+        with mock.patch('movies.api.v1.search.SEARCH_INDEX', 'broken'):
+            response = self.client.get('/api/v1/search/', {'query': 'x'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_elastic_down_is_unavailable(self):
+        with mock.patch.dict(os.environ, {'ELASTIC_PORT': '1'}):
+            response = self.client.get('/api/v1/search/', {'query': 'x'})
+        self.assertEqual(response.status_code, 503)
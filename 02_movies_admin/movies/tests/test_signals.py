@@ -0,0 +1,64 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase
+
+from movies.factories import FilmworkFactory, GenreFactory, PersonFactory
+from movies.models import FilmworkDocument, GenreFilmwork, PersonFilmwork
+from movies.signals import ChangedFilms
+
+
+# eviction registers on_commit itself, which is deferred inside a test case
+@mock.patch('movies.signals.evict_films')
+class FilmsChangedTest(TestCase):
+
+    def setUp(self):
+        # films of the rolled back transactions of other tests
+        transaction.get_connection().changed_films = ChangedFilms()
+
+    def test_film_with_inlines_is_rebuilt_once(self, evict):
+        with mock.patch('movies.signals.build_documents') as build, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            film = FilmworkFactory()
+            for genre in GenreFactory.create_batch(3):
+                GenreFilmwork.objects.create(film_work=film, genre=genre)
+            for person in PersonFactory.create_batch(2):
+                PersonFilmwork.objects.create(
+                    film_work=film, person=person, role='actor')
+
+        build.assert_called_once_with({film.id})
+        evict.assert_called_once_with({film.id})
+
+    def test_films_of_a_transaction_are_rebuilt_together(self, evict):
+        with self.captureOnCommitCallbacks(execute=True):
+            films = FilmworkFactory.create_batch(3)
+
+        self.assertEqual(
+            set(FilmworkDocument.objects.values_list('pk', flat=True)),
+            {film.id for film in films})
+        evict.assert_called_once_with({film.id for film in films})
+
+    def test_rolled_back_savepoint_keeps_later_changes(self, evict):
+        film = FilmworkFactory()
+        with mock.patch('movies.signals.build_documents') as build, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            # the call queued first is dropped with the savepoint
+            try:
+                with transaction.atomic():
+                    film.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            film.save()
+
+        self.assertEqual(len(callbacks), 1)
+        build.assert_called_once_with({film.id})
+
+    def test_films_are_taken_once(self, evict):
+        with mock.patch('movies.signals.build_documents') as build, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            film = FilmworkFactory()
+            film.save()
+
+        self.assertEqual(len(callbacks), 2)
+        build.assert_called_once_with({film.id})
@@ -3,8 +3,10 @@ import uuid
 import math
 import random
 
-from dataclasses import dataclass, field
+from dataclasses import MISSING, dataclass, field, fields
 from datetime import datetime
+from functools import lru_cache
+from typing import ClassVar
 
 from faker import Faker
 from faker.providers import lorem, date_time
@@ -14,6 +16,36 @@ fake.add_provider(lorem)
 fake.add_provider(date_time)
 Faker.seed(0)
 
+# Faker is far too slow to be called for every imported row,
+# missing values are drawn from pools generated once instead
+FILLER_POOL_SIZE = 1000
+
+# creation_date is NOT NULL, films with no dates at all get this one
+# when the filler is disabled
+UNKNOWN_DATE = '1900-01-01'
+
+
+@lru_cache(maxsize=None)
+def filler_pool(name):
+    factory = {
+        'creation_date': lambda: fake.date_between('-50y'),
+        'film_description': lambda: fake.text(max_nb_chars=100),
+        'genre_description': lambda: fake.text(max_nb_chars=30),
+    }[name]
+    return [factory() for _ in range(FILLER_POOL_SIZE)]
+
+
+def filler(name):
+    'random pre-generated value for a missing field'
+    return random.choice(filler_pool(name))
+
+
+def fix_nulls(record, fixes):
+    'replace empty values of a dict-like record with ones from fixes'
+    for name, fix in fixes.items():
+        if not record[name]:
+            record[name] = fix(record)
+
 
 @dataclass
 class FilmWork:
@@ -30,17 +62,25 @@ class FilmWork:
     file_path: str = field(default='./')
     id: uuid.UUID = field(default_factory=uuid.uuid4)
 
-    # Fixes for schema inconsistencies when importing
+    # Fixes for schema inconsistencies when importing:
+    # values to replace NULLs provided from source with
+    fixes: ClassVar[dict] = {
+        'creation_date': lambda film: filler('creation_date'),
+        'file_path': lambda film: './' + film['title'].replace(' ', ''),
+        'description': lambda film: filler('film_description'),
+        'rating': lambda film: math.floor(random.random() * 1000 / 100),
+    }
+    # plain values for NOT NULL columns, when filler is disabled
+    required_fixes: ClassVar[dict] = {
+        'creation_date': lambda film:
+            str(film['created_at'])[:10] if film['created_at']
+            else UNKNOWN_DATE,
+        'description': lambda film: '',
+        'rating': lambda film: 0.0,
+    }
+
     def __post_init__(self):
-        # Replace, if NULL provided from source
-        self.creation_date = self.creation_date or \
-            fake.date_between('-50y')
-        self.file_path = self.file_path or './' + \
-            self.title.replace(' ', '')
-        # Replace description, if NULL provided from source
-        self.description = self.description or fake.text(max_nb_chars=100)
-        # Replace description, if NULL provided from source
-        self.rating = self.rating or math.floor(random.random() * 1000 / 100)
+        fix_nulls(vars(self), self.fixes)
 
 
 @dataclass
@@ -52,9 +92,15 @@ class Genre:
     id: uuid.UUID = field(default_factory=uuid.uuid4)
 
     # Fixes for schema inconsistencies when importing
+    fixes: ClassVar[dict] = {
+        'description': lambda genre: filler('genre_description'),
+    }
+    required_fixes: ClassVar[dict] = {
+        'description': lambda genre: '',
+    }
+
     def __post_init__(self):
-        # Replace description, if NULL provided from source
-        self.description = self.description or fake.text(max_nb_chars=30)
+        fix_nulls(vars(self), self.fixes)
 
 
 @dataclass
@@ -62,11 +108,17 @@ class Person:
     full_name: str
     created_at: datetime
     updated_at: datetime
-    gender: str = field(
-        default_factory=lambda: random.choice(['male', 'female'])
-    )
+    gender: str = field(default=None)
     id: uuid.UUID = field(default_factory=uuid.uuid4)
 
+    # gender is nullable, it is left NULL when filler is disabled
+    fixes: ClassVar[dict] = {
+        'gender': lambda person: random.choice(['male', 'female']),
+    }
+
+    def __post_init__(self):
+        fix_nulls(vars(self), self.fixes)
+
 
 @dataclass
 class GenreFilmWork:
@@ -83,3 +135,39 @@ class PersonFilmWork:
     role: str
     id: uuid.UUID
     created_at: datetime
+
+
+def row_converter(target, columns, fill=True):
+    '''
+    Function turning source rows with given columns into tuples of target
+    fields, same as astuple(target(**row)) without building dataclasses.
+    NULLs are replaced by target fixes; with fill=False only NOT NULL
+    columns are, by plain values of target required_fixes.
+    '''
+    names = [f.name for f in fields(target)]
+    index = {column: i for i, column in enumerate(columns)}
+
+    # fields absent in source rows get their dataclass defaults
+    defaults = {}
+    for f in fields(target):
+        if f.name not in index:
+            defaults[f.name] = f.default_factory \
+                if f.default_factory is not MISSING \
+                else lambda value=f.default: value
+    getters = [(index.get(name), defaults.get(name)) for name in names]
+    fixes = getattr(target, 'fixes' if fill else 'required_fixes', {})
+    positions = [names.index(name) for name in fixes]
+
+    if not defaults and not fixes:
+        order = [index[name] for name in names]
+        return lambda row: tuple(row[i] for i in order)
+
+    def convert(row):
+        values = [row[i] if default is None else default()
+                  for i, default in getters]
+        if fixes and not all(values[i] for i in positions):
+            record = dict(zip(names, values))
+            fix_nulls(record, fixes)
+            return tuple(record.values())
+        return tuple(values)
+    return convert
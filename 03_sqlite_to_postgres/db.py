@@ -1,20 +1,27 @@
 
+import hashlib
+import io
+import json
 import logging
 import sqlite3
 import os
+import time
+import uuid
 
 from collections import defaultdict
 from contextlib import contextmanager
-from dataclasses import astuple, fields
+from dataclasses import fields
 from itertools import chain, islice
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, NamedTupleCursor
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from dataclass import row_converter
+
 logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
@@ -33,8 +40,11 @@ def sqlite_manager(dbfile):
     conn.close()
 
 
-@contextmanager
-def postgres_manager():
+# errors of a lost or unreachable server, worth a retry later
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def postgres_connect():
     dsl = {
         'dbname':   os.environ.get('POSTGRES_DB'),
         'user':     os.environ.get('POSTGRES_USER'),
@@ -42,11 +52,60 @@ def postgres_manager():
         'host':     os.environ.get('POSTGRES_HOST', '127.0.0.1'),
         'port':     os.environ.get('POSTGRES_PORT', 5432),
     }
-    conn = psycopg2.connect(**dsl, cursor_factory=DictCursor)
+    return psycopg2.connect(**dsl, cursor_factory=DictCursor)
+
+
+@contextmanager
+def postgres_manager():
+    conn = postgres_connect()
     yield conn
 
     conn.close()
 
+
+class PostgresConnection:
+    '''
+    Postgres connection kept open across ETL daemon cycles. It is checked
+    before each cycle and opened again if the server has dropped it.
+    A cycle always ends its transaction, not to stay idle in it till the
+    next one.
+    '''
+    def __init__(self):
+        self.conn = None
+        self.connects = 0
+
+    def alive(self):
+        if self.conn is None or self.conn.closed:
+            return False
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute('SELECT 1;')
+            self.conn.rollback()
+        except psycopg2.Error as e:
+            logger.warning(f'### Postgres: connection lost: {e}')
+            self.close()
+            return False
+        return True
+
+    @contextmanager
+    def cycle(self):
+        if not self.alive():
+            self.conn = postgres_connect()
+            self.connects += 1
+        try:
+            yield self.conn
+        finally:
+            # export only reads, nothing to commit
+            try:
+                self.conn.rollback()
+            except psycopg2.Error:
+                self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
 def chunks(iterable, chunk_size):
     iterator = iter(iterable)
     for first in iterator:
@@ -55,75 +114,320 @@ def chunks(iterable, chunk_size):
             islice(iterator, chunk_size - 1)
         )
 
+def write_json(path, data):
+    'replace the file with json data atomically, even on a crash'
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(data, fp, default=str)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(path + '.tmp', path)
+
+
+# COPY text format escapes, NULL is written as \N
+_COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r',
+})
+
+
+def copy_format(value):
+    'render a value as a COPY text format column'
+    if value is None:
+        return '\\N'
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class ImportCheckpoint:
+    '''
+    Number of rows of a SQLite table already committed to postgres,
+    kept in a local file next to the export .sync files. The file is
+    bound to the SQLite db it was made for and ignored for any other.
+    '''
+    def __init__(self, dbfile, table, keystore=None):
+        keystore = keystore or os.environ.get('DJANGO_DATA_DIR') or \
+            os.path.dirname(os.path.abspath(dbfile))
+        self.path = os.path.join(keystore, table + '.import')
+
+        stat = os.stat(dbfile)
+        self.source = [os.path.abspath(dbfile), stat.st_size, stat.st_mtime]
+        self.offset = 0
+        try:
+            with open(self.path) as fp:
+                saved = json.load(fp)
+            if saved['source'] == self.source:
+                self.offset = saved['offset']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def advance(self, count):
+        'mark next count rows committed, the file is replaced atomically'
+        self.offset += count
+        write_json(self.path, {'source': self.source, 'offset': self.offset})
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class TableStats:
+    'row counters and stage timings of one imported table'
+    stages = ('read', 'transform', 'write')
+
+    def __init__(self, table):
+        self.table = table
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_inserted = 0
+        self.bytes = 0
+        self.seconds = dict.fromkeys(TableStats.stages, 0.0)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        yield
+        self.seconds[stage] += time.perf_counter() - start
+
+    def report(self):
+        rows = {
+            'read': self.rows_read,
+            'transform': self.rows_read,
+            'write': self.rows_written,
+        }
+        return {
+            'table': self.table,
+            'rows_read': self.rows_read,
+            'rows_inserted': self.rows_inserted,
+            # already there, skipped by ON CONFLICT
+            'rows_skipped': self.rows_written - self.rows_inserted,
+            'bytes': self.bytes,
+            'seconds': {stage: round(seconds, 3)
+                        for stage, seconds in self.seconds.items()},
+            'rows_per_sec': {
+                stage: round(rows[stage] / seconds) if seconds else None
+                for stage, seconds in self.seconds.items()},
+        }
+
+
 class SQLiteLoader:
     def __init__(self, sqlite_conn, chunk_size=1000):
+        # plain tuple rows, converted by position
         self.__cursor = sqlite_conn.cursor()
+        self.__cursor.row_factory = None
         self.__chunk_size = chunk_size
         self.__num_fetched = defaultdict(lambda: 0)
 
-    def fetch_table(self, table: str, target: object):
-        # Fetch and save entire table specified
-        logger.info(f'Fetching: SELECT * FROM {table};')
+    def fetch_table(self, table: str, target: object, offset=0, fill=True,
+                    stats=None):
+        # Fetch and save entire table specified, skipping offset rows
+        # in rowid order, e.g. the ones already saved by previous run
+        sql = f'SELECT * FROM {table} ORDER BY rowid LIMIT -1 OFFSET ?;'
+        logger.info(f'Fetching: {sql} ({offset})')
         try:
-            self.__cursor.execute(f'SELECT * FROM {table};')
+            self.__cursor.execute(sql, (offset,))
         except sqlite3.Error as e:
             logger.error(e)
             return
+        convert = row_converter(
+            target, [column[0] for column in self.__cursor.description], fill)
+        stats = stats or TableStats(table)
         while True:
-            rows = self.__cursor.fetchmany(size=self.__chunk_size)
+            with stats.timer('read'):
+                rows = self.__cursor.fetchmany(size=self.__chunk_size)
             if not rows:
                 break
             self.__num_fetched[table] += len(rows)
+            stats.rows_read += len(rows)
             logger.info(f'### SQLite read: {len(rows)} rows')
 
-            # Yield data as a target dataclass instance
-            yield from [target(**row) for row in rows]
+            # Yield data as tuples of target dataclass fields
+            with stats.timer('transform'):
+                rows = [convert(row) for row in rows]
+            yield from rows
 
     def len_table(self, table):
         return self.__num_fetched[table]
 
 
 class PostgresSaver:
-    def __init__(self, postgres_conn, chunk_size=1000):
+    def __init__(self, postgres_conn, chunk_size=1000, schema='content'):
         # Disable autocommit and manual control for speed-up
         self.__connection = postgres_conn
         self.__connection.autocommit = False
 
         self.__cursor = postgres_conn.cursor()
         self.__chunk_size = chunk_size
+        self.__schema = schema
 
-    def insert_table(self, table: str, values: iter, target: object):
+    def insert_table(self, table: str, values: iter, target: object,
+                     checkpoint=None, stats=None):
         logger.info(f'### Postgres insert: {table}')
+        stats = stats or TableStats(table)
 
         # Insert all values sliced in chunks
         for chunk in chunks(values, self.__chunk_size):
-            rows_data = [astuple(i) for i in chunk]
+            rows_data = list(chunk)
             # check generator is not depleted
             if not rows_data:
                 break
 
-            rows_fmt = ','.join(['%s'] * len(rows_data))
-            col_names = ','.join(field.name for field in fields(target))
-            logger.info(f'### Postgres write: {len(rows_data)} rows')
+            with stats.timer('write'):
+                rows_fmt = ','.join(['%s'] * len(rows_data))
+                col_names = ','.join(field.name for field in fields(target))
+                logger.info(f'### Postgres write: {len(rows_data)} rows')
+
+                src = f'''INSERT INTO {self.__schema}.{table} ({col_names})
+                            VALUES {rows_fmt}
+                            ON CONFLICT (id) DO NOTHING;
+                        '''
+                # cursor.mogrify() to produce raw SQL for multiple values
+                sql = self.__cursor.mogrify(src, rows_data)
+                logger.debug(f'### Running SQL:\n{sql.decode("utf8")}')
+                self.__cursor.execute(sql)
+                inserted = self.__cursor.rowcount
+                # committing changes
+                self.__connection.commit()
+
+            stats.rows_written += len(rows_data)
+            stats.rows_inserted += inserted
+            stats.bytes += len(sql)
+            if checkpoint:
+                checkpoint.advance(len(rows_data))
+
+    def copy_table(self, table: str, values: iter, target: object,
+                   checkpoint=None, stats=None):
+        logger.info(f'### Postgres copy: {table}')
+        stats = stats or TableStats(table)
+        col_names = ','.join(field.name for field in fields(target))
+
+        # COPY can't skip conflicts, so rows land in a staging table first
+        # and are merged from there; staging is emptied by each commit
+        staging = f'staging_{table}'
+        self.__cursor.execute(
+            f'''CREATE TEMP TABLE IF NOT EXISTS {staging}
+                (LIKE {self.__schema}.{table})
+                ON COMMIT DELETE ROWS;''')
 
-            src = f'''INSERT INTO content.{table} ({col_names})
-                        VALUES {rows_fmt}
-                        ON CONFLICT (id) DO NOTHING;
-                    '''
-            # cursor.mogrify() to produce raw SQL for inserting multiple values
-            sql = self.__cursor.mogrify(src, rows_data).decode('utf8')
-            logger.debug(f'### Running SQL:\n{sql}')
-            self.__cursor.execute(sql)
-            # committing changes
-            self.__connection.commit()
+        for chunk in chunks(values, self.__chunk_size):
+            rows_data = list(chunk)
+
+            with stats.timer('write'):
+                # Stream chunk rows to the server through a memory buffer
+                data = ''.join('\t'.join(map(copy_format, row)) + '\n'
+                               for row in rows_data).encode()
+                self.__cursor.copy_expert(
+                    f'COPY {staging} ({col_names}) FROM STDIN',
+                    io.BytesIO(data))
+                copied = self.__cursor.rowcount
+                logger.info(f'### Postgres copy: {copied} rows')
+
+                self.__cursor.execute(
+                    f'''INSERT INTO {self.__schema}.{table} ({col_names})
+                        SELECT {col_names} FROM {staging}
+                        ON CONFLICT (id) DO NOTHING;''')
+                inserted = self.__cursor.rowcount
+                # committing changes
+                self.__connection.commit()
+
+            stats.rows_written += copied
+            stats.rows_inserted += inserted
+            stats.bytes += len(data)
+            if checkpoint:
+                checkpoint.advance(copied)
+
+
+def import_table(dbfile, table, target, method='copy_table',
+                 chunk_size=10000, resume=True, fill=True):
+    '''
+    Load one SQLite table into postgres, on connections of its own.
+    Committed chunks are checkpointed, so a rerun after a failure
+    continues from the first row not saved yet. Returns table stats.
+    '''
+    checkpoint = ImportCheckpoint(dbfile, table)
+    if not resume:
+        checkpoint.offset = 0
+    elif checkpoint.offset:
+        logger.info(f'### Import: resuming {table} '
+                    f'after {checkpoint.offset} rows')
+
+    stats = TableStats(table)
+    with sqlite_manager(dbfile) as sqlt:
+        with postgres_manager() as psg:
+            loader = SQLiteLoader(sqlt)
+            saver = PostgresSaver(psg, chunk_size=chunk_size)
+            save_table = getattr(saver, method)
+            save_table(table,
+                       loader.fetch_table(
+                           table, target, checkpoint.offset, fill, stats),
+                       target, checkpoint=checkpoint, stats=stats)
+    return stats.report()
+
+
+def verify_table(dbfile, table, target, schema='content', chunk_size=10000,
+                 sample=10):
+    '''
+    Compare rows of a SQLite table with the imported ones, by id. Only the
+    ids taken from SQLite are looked up in postgres, rows of other sources
+    do not count. Rows are compared by md5 of the text and uuid columns
+    copied as is; missing and differing ids are reported, a few of each.
+    '''
+    with sqlite_manager(dbfile) as sqlt:
+        cursor = sqlt.cursor()
+        cursor.row_factory = None
+        source = [column[1] for column in
+                  cursor.execute(f'PRAGMA table_info({table});')]
+        fixes = getattr(target, 'fixes', {})
+        checked = [field for field in fields(target)
+                   if field.type in (str, uuid.UUID)
+                   and field.name in source and field.name not in fixes]
+        columns = [field.name for field in checked]
+        # postgres renders uuids in lower case
+        render = [str.lower if field.type is uuid.UUID else str
+                  for field in checked]
+        key = columns.index('id')
+
+        cursor.execute(f'SELECT {",".join(columns)} FROM {table};')
+        digests = {}
+        for row in cursor:
+            values = [func(value) for func, value in zip(render, row)
+                      if value is not None]
+            digests[render[key](row[key])] = hashlib.md5(
+                '|'.join(values).encode()).hexdigest()
+
+    # concat_ws skips NULLs just as the join above
+    text = ', '.join(f'{column}::text' for column in columns)
+    missing, differ = set(digests), []
+    with postgres_manager() as psg:
+        with psg.cursor() as cursor:
+            for ids in chunks(digests, chunk_size):
+                cursor.execute(
+                    f'''SELECT id::text, md5(concat_ws('|', {text}))
+                        FROM {schema}.{table} WHERE id = ANY(%s::uuid[]);''',
+                    (list(ids),))
+                for id, digest in cursor:
+                    missing.discard(id)
+                    if digests[id] != digest:
+                        differ.append(id)
+
+    return {
+        'table': table,
+        'columns': columns,
+        'source_rows': len(digests),
+        'target_rows': len(digests) - len(missing),
+        'missing': len(missing),
+        'differ': len(differ),
+        'missing_ids': sorted(missing)[:sample],
+        'differ_ids': sorted(differ)[:sample],
+        'ok': not missing and not differ,
+    }
 
 
 class PostgresETL:
-    def __init__(self, model, postgres_conn, chunk_size=1000):
+    def __init__(self, model, postgres_conn, chunk_size=1000, itersize=None):
         self.connection = postgres_conn
         self.cursor = postgres_conn.cursor()
         self.chunk_size = chunk_size
+        self.itersize = itersize or chunk_size
         self.num_fetched = 0
+        self.num_queries = 0
 
         self.model = model
         self.keystore = os.environ.get('DJANGO_DATA_DIR')
@@ -131,94 +435,251 @@ class PostgresETL:
     def extract(self, query):
         # exceptions should be handled on app level
         logger.debug(f'### Extractor: Running SQL query:\n{query}')
-        self.cursor.execute(query)
-        while True:
-            rows = self.cursor.fetchmany(self.chunk_size)
-            if not rows:
-                break
-            logger.info(f'### Postgres produced: {len(rows)} rows')
-            self.num_fetched += len(rows)
-            yield from rows
+
+        # Named cursor keeps the result on the server, only itersize rows
+        # at a time are held in memory; rows are light named tuples
+        self.num_queries += 1
+        name = f'etl_{self.model}_{id(self)}_{self.num_queries}'
+        with self.connection.cursor(
+                name, cursor_factory=NamedTupleCursor) as cursor:
+            cursor.itersize = self.itersize
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(self.itersize)
+                if not rows:
+                    break
+                logger.info(f'### Postgres produced: {len(rows)} rows')
+                self.num_fetched += len(rows)
+                yield from rows
     
     def num_extracted(self):
         return self.num_fetched
 
-class PostgresProducer(PostgresETL):
-    def __init__(self, model, postgres_conn, startdate=None, chunk_size=1000):
-        super().__init__(model, postgres_conn, chunk_size)
-
-        if type(startdate) == datetime:
-            self.startdate = startdate
+class ETLState:
+    '''
+    Export watermarks: the greatest (stamp, id) processed of every source,
+    kept in a json file in DJANGO_DATA_DIR. The file is replaced as a whole,
+    so after a crash it holds either the previous or the new cycle state.
+    '''
+    def __init__(self, keystore=None, name='etl_state'):
+        keystore = keystore or os.environ.get('DJANGO_DATA_DIR')
+        self.path = os.path.join(keystore, name + '.json')
+        self.default = None
+        try:
+            with open(self.path) as fp:
+                self.state = json.load(fp)
+        except (OSError, ValueError):
+            self.state = {}
+            self.migrate(keystore)
+
+    def migrate(self, keystore):
+        # start from the former film_work.sync pointer, if there is one
+        try:
+            with open(os.path.join(keystore, 'film_work.sync')) as fp:
+                stamp = datetime.strptime(
+                    fp.read(), '%Y-%m-%d %H:%M:%S').replace(
+                        tzinfo=timezone.utc)
+        except (OSError, ValueError):
             return
+        logger.info(f'### ETL state: starting from film_work.sync {stamp}')
+        self.default = (stamp.isoformat(), str(uuid.UUID(int=0)))
+
+    def get(self, key):
+        'watermark of the source as (stamp, id), None if never synced'
+        value = self.state.get(key, self.default)
+        return (datetime.fromisoformat(value[0]), value[1]) if value else None
+
+    def set(self, key, watermark):
+        self.state[key] = [watermark[0].isoformat(), str(watermark[1])]
+
+    def save(self):
+        write_json(self.path, self.state)
+
+
+class DocumentHashes:
+    '''
+    Hashes of the documents last indexed, by film id, kept in a SQLite db
+    in DJANGO_DATA_DIR. Hashes of a cycle are written in a transaction,
+    committed once its documents are indexed and rolled back otherwise.
+    Counters of written and skipped documents are per transaction too.
+    '''
+    def __init__(self, keystore=None, name='etl_hashes'):
+        keystore = keystore or os.environ.get('DJANGO_DATA_DIR')
+        # filled from the bulk indexing thread, committed from the main one
+        self.connection = sqlite3.connect(
+            os.path.join(keystore, name + '.sqlite'),
+            check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS hashes '
+            '(id TEXT PRIMARY KEY, hash TEXT NOT NULL);')
+        self.connection.commit()
+        self.written = 0
+        self.skipped = 0
+
+    @staticmethod
+    def digest(doc):
+        'stable hash of a document, whatever the order of its keys'
+        data = json.dumps(doc, sort_keys=True, separators=(',', ':'),
+                          default=str)
+        return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+    def changed(self, docs, chunk_size=500, force=False):
+        '''
+        Docs that differ from the ones indexed, their hashes are stored.
+        With force every doc passes, e.g. to resend docs to a damaged index.
+        '''
+        for chunk in chunks(docs, chunk_size):
+            chunk = list(chunk)
+            ids = [doc['id'] for doc in chunk]
+            known = dict(self.connection.execute(
+                f'SELECT id, hash FROM hashes '
+                f'WHERE id IN ({",".join("?" * len(ids))});', ids))
+
+            changed, hashes = [], []
+            for doc in chunk:
+                digest = DocumentHashes.digest(doc)
+                if not force and known.get(doc['id']) == digest:
+                    continue
+                changed.append(doc)
+                hashes.append((doc['id'], digest))
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO hashes VALUES (?, ?);', hashes)
+
+            self.written += len(changed)
+            self.skipped += len(chunk) - len(changed)
+            yield from changed
+
+    def clear(self):
+        'forget all hashes, e.g. for a full reindex into an empty index'
+        self.connection.execute('DELETE FROM hashes;')
+
+    def commit(self):
+        self.connection.commit()
+        self.written = self.skipped = 0
+
+    def rollback(self):
+        self.connection.rollback()
+        self.written = self.skipped = 0
+
+    def close(self):
+        self.connection.close()
+
+
+class PostgresChangeDetector(PostgresETL):
+    '''
+    Producer of film_work ids affected by any change since the last sync:
+    films themselves, their persons and genres, links added to through
+    tables and documents rebuilt by the admin (e.g. on removed links).
+
+    Every source is read between its stored watermark and the greatest
+    (stamp, id) seen at the start of the cycle, all in one query, each
+    film coming out once. New watermarks are saved by commit(), once the
+    films are exported, so nothing is skipped and nothing is redone.
+
+    Stamps are taken when rows are written, not when they are committed:
+    a transaction committing later may bring rows stamped below a bound
+    already passed. Rows stamped within the last lag are left for the
+    next cycle, so such rows are missed only if committed after the lag.
+    '''
+    lag = timedelta(minutes=1)
+
+    # source: table, its stamp and id columns, film ids of its rows
+    # and the join to reach them
+    sources = {
+        'film_work': ('content.film_work', 'updated_at', 'id',
+                      's.id', ''),
+        'person': ('content.person', 'updated_at', 'id',
+                   'rel.film_work_id', 'JOIN content.person_film_work rel '
+                                       'ON rel.person_id = s.id'),
+        'genre': ('content.genre', 'updated_at', 'id',
+                  'rel.film_work_id', 'JOIN content.genre_film_work rel '
+                                      'ON rel.genre_id = s.id'),
+        'person_film_work': ('content.person_film_work', 'created_at', 'id',
+                             's.film_work_id', ''),
+        'genre_film_work': ('content.genre_film_work', 'created_at', 'id',
+                            's.film_work_id', ''),
+        'film_work_document': ('content.film_work_document', 'updated_at',
+                               'film_work_id', 's.film_work_id', ''),
+    }
 
-        self.last_sync = os.path.join(self.keystore, self.model + '.sync')
-        if not os.path.exists(self.last_sync): 
-            logger.info(
-                f'### Extractor: created sync file for {self.model}')
-            with open(self.last_sync, 'w') as fp:
-                fp.write(datetime.min.strftime("%Y-%m-%d %H:%M:%S"))
-
-        # load latest sync date
-        with open(self.last_sync) as f:
-            try:
-                stamp = f.read()
-                logger.info(
-                    f'### Extractor: last sync for {self.model}: {stamp}')
-                self.startdate = \
-                    datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S")
-
-            except:
-                self.startdate = datetime.min
+    def __init__(self, postgres_conn, startdate=None, chunk_size=1000,
+                 state=None, itersize=None, full=False, lag=None):
+        super().__init__('film_work', postgres_conn, chunk_size, itersize)
+        self.state = state or ETLState(self.keystore)
+        self.bounds = {}
+        if lag is not None:
+            self.lag = lag
+
+        # an explicit start date overrides the stored state
+        self.watermarks = {source: self.state.get(source)
+                           for source in PostgresChangeDetector.sources}
+        if type(startdate) == datetime:
+            self.watermarks = dict.fromkeys(
+                self.watermarks, (startdate, str(uuid.UUID(int=0))))
+        # or all films are produced, for a full reindex
+        self.full = full
+        if full:
+            self.watermarks = dict.fromkeys(self.watermarks)
 
     def get_startdate(self):
-        'get computed export starting date for the model'
-        return self.startdate
-    
-    def set_startdate(self):
-        'set updated sync pointer to mark previous changes done'
-        with open(self.last_sync, 'w') as fp:
-            self.startdate = datetime.utcnow()
-            fp.write(self.startdate.strftime("%Y-%m-%d %H:%M:%S"))
+        'get the film_work watermark, the export is in sync up to'
+        return self.watermarks['film_work']
+
+    def fetch_bounds(self):
+        # greatest (stamp, id) of every source older than the lag, the
+        # upper end of the cycle
+        sources = PostgresChangeDetector.sources
+        sql = ' UNION ALL '.join(
+            f"""(SELECT '{source}', {stamp}, {id} FROM {table}
+                 WHERE {stamp} <= statement_timestamp() - %s
+                 ORDER BY {stamp} DESC, {id} DESC LIMIT 1)"""
+            for source, (table, stamp, id, *_) in sources.items())
+        self.cursor.execute(sql + ';', [self.lag] * len(sources))
+        return {row[0]: (row[1], row[2]) for row in self.cursor.fetchall()}
 
     def produce(self):
-        'get records, updated after computed starting date'
+        'get ids of films to export, deduplicated by UNION'
+        self.bounds = self.fetch_bounds()
+        arms, params = [], []
+        for source, bound in self.bounds.items():
+            # every film comes from film_work anyway, others just move on
+            if self.full and source != 'film_work':
+                continue
+            table, stamp, id, films, join = \
+                PostgresChangeDetector.sources[source]
+            select = f'SELECT {films} AS id FROM {table} s {join}'
+
+            where = [f'(s.{stamp}, s.{id}) <= (%s, %s)']
+            params.extend(bound)
+            if self.watermarks[source]:
+                where.append(f'(s.{stamp}, s.{id}) > (%s, %s)')
+                params.extend(self.watermarks[source])
+            arms.append(f'{select} WHERE {" AND ".join(where)}')
+
+        if not arms:
+            return
+        sql = ' UNION '.join(arms) + ';'
+        yield from self.extract(
+            self.cursor.mogrify(sql, params).decode('utf8'))
 
-        sql = f"SELECT id FROM content.{self.model} \
-            WHERE updated_at > '{self.startdate.strftime('%Y-%m-%d %H:%M:%S')}' \
-            ORDER BY updated_at;"
-        yield from self.extract(sql)
+    def commit(self):
+        'store watermarks of the exported cycle'
+        for source, bound in self.bounds.items():
+            self.state.set(source, bound)
+        self.state.save()
+        self.watermarks.update(self.bounds)
 
 
 class PostgresEnricher(PostgresETL):
-    def __init__(self, model, postgres_conn, chunk_size=1000):
-        super().__init__(model, postgres_conn, chunk_size)
+    def __init__(self, model, postgres_conn, chunk_size=1000, itersize=None):
+        super().__init__(model, postgres_conn, chunk_size, itersize)
         self.target = {}
         self.total_uids = 0
 
-    def find_target(self, updated):
-        'find fw records, affected by produced updates to db'
-
-        for chunk in chunks(updated, self.chunk_size):
-            ids = list(map(lambda r: r['id'], chunk))
-            if not len(ids):
-                return
-            logger.info(f'### Enricher: new chunk of {len(ids)}, cascading...')
-
-            src = f'SELECT fw.id \
-                FROM content.film_work fw \
-                LEFT JOIN content.{self.model}_film_work relfw \
-                ON relfw.film_work_id = fw.id \
-                WHERE relfw.{self.model}_id \
-                IN ({",".join(["%s"] * len(ids))}) \
-                ORDER BY fw.updated_at'
-            sql = self.cursor.mogrify(src, ids).decode('utf8')
-            yield from self.extract(sql)
-            logger.info(f'### Enricher: find chunk done\n')
-
     def init_target(self, cascaded):
         # init the elastic dict with unique uid records
         for chunk in chunks(cascaded, chunk_size=500):
-            for uid in list(map(lambda r: str(r['id']), chunk)):
+            for uid in list(map(lambda r: str(r.id), chunk)):
                 self.total_uids += 1
                 self.target[uid] = { 
                     'id': uid, 
@@ -258,24 +719,54 @@ class PostgresEnricher(PostgresETL):
             yield from self.extract(sql)
             logger.info(f'### Enricher: enrich chunk done\n')
 
+    def stream(self, updated):
+        '''
+        Enrich updated films chunk by chunk, yielding lists of documents;
+        the target holds one chunk at a time, the next one is fetched
+        only after the previous one has been consumed
+        '''
+        for chunk in chunks(updated, self.chunk_size):
+            self.target = {}
+            self.init_target(chunk)
+            self.merge_target(self.enrich_target())
+            logger.info(f'### Enricher: {len(self.target)} documents ready')
+            yield list(self.target.values())
+        self.target = {}
+
     def merge_target(self, enriched):
-        # merge joined enriched rows to build unique dicts for elastic
-        for chunk in chunks(enriched, chunk_size=500):
-            for row in list(chunk):
-                id = str(row['fw_id'])
-                self.target[id]['description'] = row['description']
-                self.target[id]['title'] = row['title']
-                self.target[id]['imdb_rating'] = row['rating']
-
-                if row['role'] == 'director':
-                    self.target[id]['director'] = row['full_name']
-
-                if row['role'] in ['actor', 'writer']:
-                    if not row['full_name'] in self.target[id][f'{row["role"]}s_names']:
-                        self.target[id][f'{row["role"]}s_names'] += (row['full_name'] + ',')
-                        self.target[id][f'{row["role"]}s'].append({
-                            'id': str(row['pid']),
-                            'name': row['full_name']
-                        })
-                if not row['gname'] in self.target[id]['genre']:
-                    self.target[id]['genre'].append(row['gname'])
+        # merge joined enriched rows to build unique dicts for elastic;
+        # the join repeats every person for each genre of the film, so
+        # persons are collected by id and genres by name first, and the
+        # documents are filled once per film
+        merged = {}
+        for row in enriched:
+            film = merged.get(row.fw_id)
+            if film is None:
+                film = merged[row.fw_id] = {
+                    'row': row, 'director': None,
+                    'actor': {}, 'writer': {}, 'genre': {},
+                }
+            if row.role == 'actor' or row.role == 'writer':
+                film[row.role][row.pid] = row.full_name
+            elif row.role == 'director':
+                film['director'] = row.full_name
+            film['genre'][row.gname] = None
+
+        for fw_id, film in merged.items():
+            target = self.target[str(fw_id)]
+            target['description'] = film['row'].description
+            target['title'] = film['row'].title
+            target['imdb_rating'] = film['row'].rating
+            if film['director'] is not None:
+                target['director'] = film['director']
+
+            # sorted, join order is arbitrary and documents are compared
+            for role in ('actor', 'writer'):
+                persons = sorted((name, str(pid))
+                                 for pid, name in film[role].items())
+                target[f'{role}s_names'] = ''.join(
+                    name + ',' for name, _ in persons)
+                target[f'{role}s'] = [
+                    {'id': pid, 'name': name} for name, pid in persons
+                ]
+            target['genre'] = sorted(film['genre'], key=lambda g: g or '')
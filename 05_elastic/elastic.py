@@ -4,11 +4,19 @@ import logging
 import os, sys
 from pprint import pprint
 
-from typing import Dict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
 from dataclasses import asdict
 
-from elasticsearch import Elasticsearch
+from elasticsearch import ConnectionError, Elasticsearch
 from elasticsearch import helpers
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 sys.path.append('../03_sqlite_to_postgres')
 import db
@@ -17,30 +25,130 @@ logger = logging.getLogger(__name__)
 logger.setLevel('INFO')
 
 
+class ElasticUnavailable(Exception):
+    'elasticsearch does not answer a health check'
+
+
+# errors of a lost or unreachable cluster, worth a retry later
+CONNECTION_ERRORS = (ConnectionError, ElasticUnavailable)
+
+
+class OrjsonSerializer(JSONSerializer):
+    'bulk bodies are encoded with orjson when it is installed, a lot faster'
+    def dumps(self, data):
+        if isinstance(data, str):
+            return data
+        try:
+            return orjson.dumps(data, default=self.default).decode()
+        except TypeError as e:
+            raise SerializationError(data, e)
+
+
 class EsManager:
-    def __init__(self, index, chunk_size=1000):
+    def __init__(self, index, chunk_size=1000, threads=4,
+                 chunk_bytes=10 * 1024 * 1024):
         host=os.environ["ELASTIC_HOST"]
         port=os.environ["ELASTIC_PORT"]
 
-        self.es_client = Elasticsearch([f'{host}:{port}'])
-        logger.info(self.es_client.ping())
+        # keep-alive connections, one per bulk thread, are reopened by the
+        # pool as elastic drops them, so the client can live for the
+        # whole run of a daemon; a timed out request is retried
+        self.__host = f'{host}:{port}'
+        self.es_client = Elasticsearch(
+            [self.__host],
+            serializer=OrjsonSerializer() if orjson else JSONSerializer(),
+            maxsize=max(threads, 10), retry_on_timeout=True)
 
+        # bulk requests are cut by docs count or body size, what comes first
         self.__chunk_size = chunk_size
+        self.__chunk_bytes = chunk_bytes
+        self.__threads = threads
         self.__index = index
 
-    def create_index(self, schema: Dict) -> None:
+    def check(self) -> None:
+        '''
+        Health check before a batch of work, e.g. an ETL cycle.
+        :raises ElasticUnavailable: If the cluster does not answer a ping.
+        '''
+        if not self.es_client.ping():
+            raise ElasticUnavailable(f'{self.__host} does not answer ping')
+        logger.info(f'### Elastic: {self.__host} is up')
+
+    def close(self) -> None:
+        self.es_client.close()
+
+    def create_index(self, schema: Dict, index: Optional[str] = None,
+                     exist_ok: bool = True) -> None:
         '''
         Create an ES index.
-        :param index_name: Name of the index.
-        :param mapping: Mapping of the index
+        :param schema: Settings and mappings of the index.
+        :param index: Name of the index, the managed one by default.
+        :param exist_ok: Whether to ignore a failed create (400), e.g. of
+            an index already there; raise otherwise.
         '''
-        logger.info(f'### Elastic: Creating index {self.__index} with the following schema: \
+        index = index or self.__index
+        logger.info(f'### Elastic: Creating index {index} with the following schema: \
                      {json.dumps(schema, indent=2)}')
-        self.es_client.indices.create(index=self.__index, body=schema, ignore=400)
+        self.es_client.indices.create(
+            index=index, body=schema, ignore=400 if exist_ok else ())
     
-    def delete_index(self) -> None:
+    def delete_index(self, index: Optional[str] = None) -> None:
         # ignore 404 and 400
-        self.es_client.indices.delete(index=self.__index, ignore=[400, 404])
+        self.es_client.indices.delete(
+            index=index or self.__index, ignore=[400, 404])
+
+    def build_index(self, schema_file: str) -> str:
+        '''
+        Create a fresh versioned index for a full reindex, tuned for bulk
+        loading: refresh is off and there are no replicas to copy docs to,
+        until the index is published under the managed name.
+        :param schema_file: Path of the index schema.
+        :return: Name of the new index.
+        '''
+        with open(schema_file) as fp:
+            schema = json.load(fp)
+        schema.setdefault('settings', {}).update(
+            refresh_interval='-1', number_of_replicas=0)
+
+        index = f'{self.__index}_{datetime.utcnow():%Y%m%d%H%M%S}'
+        # bulk load would auto-create a failed index with dynamic mapping
+        self.create_index(schema, index, exist_ok=False)
+        return index
+
+    def publish_index(self, index: str, schema_file: str) -> None:
+        '''
+        Restore schema settings of a loaded index, merge its segments and
+        atomically point the managed name, an alias, to it. Indices the
+        alias pointed to before are deleted afterwards.
+        :param index: Name of the loaded index.
+        :param schema_file: Path of the index schema.
+        '''
+        with open(schema_file) as fp:
+            settings = json.load(fp).get('settings', {})
+        self.es_client.indices.put_settings(index=index, body={'index': {
+            'refresh_interval': settings.get('refresh_interval', '1s'),
+            'number_of_replicas': settings.get('number_of_replicas', 1),
+        }})
+        self.es_client.indices.refresh(index=index)
+        logger.info(f'### Elastic: Force merging {index}')
+        self.es_client.indices.forcemerge(
+            index=index, max_num_segments=1, request_timeout=3600)
+
+        actions, previous = [], []
+        if self.es_client.indices.exists_alias(name=self.__index):
+            previous = list(self.es_client.indices.get_alias(name=self.__index))
+            actions += [{'remove': {'index': name, 'alias': self.__index}}
+                        for name in previous]
+        elif self.es_client.indices.exists(index=self.__index):
+            # a plain index under the managed name, as created before
+            actions.append({'remove_index': {'index': self.__index}})
+        actions.append({'add': {'index': index, 'alias': self.__index}})
+
+        logger.info(f'### Elastic: Pointing {self.__index} to {index}')
+        self.es_client.indices.update_aliases(body={'actions': actions})
+        for name in previous:
+            if name != index:
+                self.delete_index(name)
 
 
     def create_schema(self, schema_file: str) -> None:
@@ -53,21 +161,49 @@ class EsManager:
             self.create_index(schema)
 
 
-    def populate_index(self, docs: list) -> None:
+    def populate_index(self, docs: Iterable[Dict],
+                       index: Optional[str] = None) -> Tuple[int, List]:
         '''
-        Populate an index from docs list
-        :param docs: The list of prepared docs to insert.
-        :param index_name: Name of the index to which documents should be written.
+        Populate an index from docs, streaming them in bulk requests.
+        Docs are consumed lazily and sent by a pool of threads; a failed
+        doc is logged and reported, the rest of the batch goes on.
+        :param docs: Iterable of prepared docs to insert.
+        :param index: Name of the index, the managed one by default.
+        :return: Number of indexed docs and ids of the failed ones.
         '''
-        logger.info(f'### Elastic: Bulk Write {len(docs)} docs to {self.__index}')
-        k = [{
-                "_index": self.__index,
+        index = index or self.__index
+        logger.info(f'### Elastic: Bulk Write docs to {index}')
+        # docs go as dicts, serialized once by the client
+        actions = ({
+                "_index": index,
                 "_id"   : doc['id'],
-                "_source": json.dumps(doc),
-             } for doc in docs]
-
-        helpers.bulk(self.es_client, k)
-        logger.info('### Elastic: Written last doc in batch')
+                "_source": doc,
+             } for doc in docs)
+
+        options = dict(chunk_size=self.__chunk_size,
+                       max_chunk_bytes=self.__chunk_bytes,
+                       raise_on_error=False, raise_on_exception=False)
+        if self.__threads > 1:
+            results = helpers.parallel_bulk(
+                self.es_client, actions, thread_count=self.__threads,
+                queue_size=self.__threads, **options)
+        else:
+            results = helpers.streaming_bulk(
+                self.es_client, actions, **options)
+
+        indexed, failed = 0, []
+        for ok, item in results:
+            if ok:
+                indexed += 1
+                continue
+            result = next(iter(item.values()))
+            failed.append(result.get('_id'))
+            logger.error(f'### Elastic: Failed doc {result.get("_id")}: '
+                         f'{result.get("error") or result.get("exception")}')
+
+        logger.info(f'### Elastic: Written {indexed} docs, '
+                    f'{len(failed)} failed')
+        return indexed, failed
 
     def search(self, term):
         query_body = {